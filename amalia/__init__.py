@@ -11,7 +11,7 @@ import tools.Cache as Cache
 from tools.ReportWriter import ReportWriter
 from tools.EventGeneration import convert_date
 from reports.ReportFactory import ReportFactory
-from dataframe.DataFrame import DataFrame, load
+from dataframe.DataFrame import DataFrame, load, time_bounds
 from simulation.SimulationFactory import SimulationFactory
 
 
@@ -22,6 +22,23 @@ def _get_debug_trim(cfg: ConfigHandler):
     return trim
 
 
+# Keyword arguments of dataframe.DataFrame.load from the dataframe options of a config
+def _load_options(cfg):
+    cache_path = cfg.get('cache_path', default='')
+    if not cache_path or not cfg.get('dataframe.ingest_cache', default=True):
+        cache_directory = None
+    else:
+        cache_directory = os.path.join(cache_path, 'ingest')
+    start_date = cfg.get('dataframe.start_date', default='')
+    end_date = cfg.get('dataframe.end_date', default='')
+    return {'timezone': cfg.get('dataframe.timezone', default='local'), 'cache_directory': cache_directory,
+            'n_workers': cfg.get('dataframe.load_workers', default=0),
+            'start_date': convert_date(start_date) if start_date != '' else None,
+            'end_date': convert_date(end_date) if end_date != '' else None,
+            'columns': cfg.get('dataframe.columns', default=[]) or None,
+            'json_keys': cfg.get('dataframe.json_keys', default={})}
+
+
 def compare(config_path):
     compare_cfg = ConfigHandler(config_path)
     results = {}
@@ -29,12 +46,13 @@ def compare(config_path):
     source = compare_cfg.get('source', False)
     if source:
         logger.debug(f'Using source {source}')
-        source_df = load({'source': source})['source']
-
         start = compare_cfg.get('source_limits.start_date', type=convert_date, default='2018-01-01 00:00:00')
         end = compare_cfg.get('source_limits.end_date', type=convert_date, default='2018-04-14 23:59:59')
 
-        source_df = source_df[(start < source_df['nodeTime']) & (source_df['nodeTime'] < end)]
+        options = dict(_load_options(compare_cfg), start_date=start, end_date=end)
+        source_df = load({'source': source}, **options)['source']
+        lower, upper = time_bounds(source_df['nodeTime'].to_numpy(), start, end, closed='neither')
+        source_df = source_df.iloc[lower:upper]
         results['source'] = source_df
 
     for config in compare_cfg.get('configs'):
@@ -62,8 +80,9 @@ def run(config_path):
     sim_key = cfg.get('sim_type')
 
     n_workers = cfg.get('dask.n_workers')
+    use_dask = cfg.get('map_reduce.backend', default='dask') == 'dask' and n_workers > 1
 
-    if n_workers > 1:
+    if use_dask:
         memory_limit = cfg.get('dask.memory_limit')
         local_directory = cfg.get('dask.local_directory')
         if local_directory == 'default':
@@ -71,10 +90,15 @@ def run(config_path):
         open_dask(n_workers=n_workers, memory_limit=memory_limit, local_directory=local_directory)
         logger.info('Initializing Dask')
 
-    data_loader = DataFrame(cfg.get('data_loader', type=dict))
-    result = SimulationFactory(cfg).run_simulation(sim_key, data_loader)
+    data_loader = DataFrame(cfg.get('data_loader', type=dict), **_load_options(cfg),
+                            memory_budget=cfg.get('dataframe.memory_budget', default=0))
+    if cfg.get('output.stream', default=False):
+        # Events are generated while they are written, see OutputWriter.write
+        result = SimulationFactory(cfg).stream_simulation(sim_key, data_loader)
+    else:
+        result = SimulationFactory(cfg).run_simulation(sim_key, data_loader)
 
-    if n_workers > 1:
+    if use_dask:
         close_dask()
         logger.info('Closing Dask')
 
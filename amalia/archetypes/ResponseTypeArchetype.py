@@ -3,9 +3,10 @@ import logging
 logger = logging.getLogger(__name__.split('.')[-1])
 
 import numpy as np
-import collections
-from scipy.sparse import csr_matrix, csc_matrix
+import pandas as pd
+from scipy.sparse import coo_matrix
 import tools.Cache as Cache
+from tools.Utilities import grow_sparse
 
 
 class ResponseTypeArchetype:
@@ -45,25 +46,45 @@ class ResponseTypeArchetype:
 
         return res
 
+    def append(self, res, dfs, platform, new_rows):
+        '''
+        Update the result of compute() in place for rows appended to a platform with
+        DataFrame.append(). Matrices grow by the users new to the node map, and only
+        the responses among the appended rows are counted, with their parents looked
+        up in the whole dataset.
+        '''
+        node_map = dfs.get_node_map(platform)
+        shape = (len(node_map), len(node_map))
+        added = _process_function(dfs.get_df(platform), node_map, self.response_types[platform], responses=new_rows)
+        for action, matrix in added.items():
+            res[platform][action] = grow_sparse(res[platform][action], shape) + matrix
+        return res
+
+
+def _process_function(df, node_map, response_types, responses=None, *args, **kwargs):
+    # Counts the responses among the rows of responses (default: all of df) to parents in df.
+    # nodeID and parentID are interned int64 keys, so the user of every parent is looked up in
+    # one pass through an array indexed by key, holding the user of the event with that nodeID.
+    if responses is None:
+        responses = df
+    node_ids = df['nodeID'].to_numpy()
+    parent_ids = responses['parentID'].to_numpy()
+    owners = np.full(max(node_ids.max(initial=-1), parent_ids.max(initial=-1)) + 2, -1, dtype=np.int32)
+    present = node_ids >= 0
+    owners[node_ids[present]] = df['userIdx'].to_numpy()[present]
+    # Missing parents have key -1, which picks the trailing -1
+    parent_users = owners[parent_ids]
+
+    action_codes = pd.Categorical(responses['actionType'], categories=response_types).codes
+    found = (action_codes >= 0) & (parent_users >= 0)
+    action_codes, rows, cols = action_codes[found], responses['userIdx'].to_numpy()[found], parent_users[found]
 
-def _process_function(df, node_map, response_types, *args, **kwargs):
     dep = {}
-    nm_dict = dict(zip(node_map, range(len(node_map))))
-    for action in response_types:
-        df_t = df[df['actionType'] == action]
-        df_temp = df[(df.nodeID.isin(df_t['parentID'].tolist()))]
-        if len(df_temp) > 0:
-            nID_to_uID_map = dict(zip(df_temp.nodeID.tolist(), df_temp.nodeUserID.tolist()))
-            df_t = df_t[df_t.parentID.isin(nID_to_uID_map.keys())]
-            rows = df_t['nodeUserID'].tolist()
-            cols = list(map(nID_to_uID_map.__getitem__, df_t['parentID']))
-            row_ind = [nm_dict[i] for i in rows]
-            col_ind = [nm_dict[i] for i in cols]
-            counter = collections.Counter(zip(row_ind, col_ind))
-            indices = list(zip(*counter.keys()))
-            dep[action] = csr_matrix((list(counter.values()), (indices[0], indices[1])),
-                                     shape=((len(node_map), len(node_map))))
-        else:
-            dep[action] = csr_matrix(((len(node_map), len(node_map))), dtype=int)
+    shape = (len(node_map), len(node_map))
+    for code, action in enumerate(response_types):
+        is_action = action_codes == code
+        counts = coo_matrix((np.ones(is_action.sum(), dtype=int), (rows[is_action], cols[is_action])), shape=shape)
+        counts.sum_duplicates()
+        dep[action] = counts.tocsr()
 
-    return dep
\ No newline at end of file
+    return dep
@@ -4,10 +4,15 @@ logger = logging.getLogger(__name__.split('.')[-1])
 
 import sys
 import itertools
+import weakref
 import numpy as np
 import pandas as pd
 import scipy.sparse as ss
 import tools.Cache as Cache
+from tools.Utilities import grow_sparse
+
+# Levels of the pyramid mode per DataFrame, see TimeSeriesArchetype.compute_resolution()
+_pyramids = weakref.WeakKeyDictionary()
 
 
 class TimeSeriesArchetype:
@@ -28,6 +33,12 @@ class TimeSeriesArchetype:
         the platform and the value is the action type that
         represents base activity within the platform.
 
+    resolutions : list (default : [])
+        Time deltas (Pandas Timedelta strings) to serve from
+        one binning of the events. If given, the events are
+        binned by the finest of them only, and time_delta
+        and every other resolution must be a multiple of it.
+
     Output
     ------
 
@@ -46,37 +57,145 @@ class TimeSeriesArchetype:
     column-slicing operations, which makes for faster
     replay segmentation within the ReplayTimeSeriesFeature
     specifically.
+
+    In pyramid mode (resolutions given), coarser time series
+    are derived from the finest one by multiplying it with a
+    0/1 matrix that maps fine to coarse columns. Bins are
+    aligned to multiples of their time delta, so every fine
+    bin lies within one coarse bin, and the result equals
+    binning the events by the coarse time delta directly.
     
     '''
 
     def __init__(self, cfg):
         self.time_delta = cfg.get('limits.time_delta', type=pd.Timedelta).total_seconds()
         self.base_action = cfg.get('time_series_archetype.base_actions')
+        self.resolutions = sorted(pd.Timedelta(resolution).total_seconds()
+                                  for resolution in cfg.get('time_series_archetype.resolutions', default=[]))
 
         self.cfg = cfg
 
     @Cache.amalia_cache
     def compute(self, dfs):
         logger.info('Generating base activity time series.')
-        platforms = dfs.get_platforms()
-        res = {}
-        for platform in platforms:
+        if self.resolutions:
+            return self.compute_resolution(dfs, self.time_delta)
+        return self._bin(dfs, self.time_delta)
+
+    def compute_resolution(self, dfs, time_delta):
+        '''
+
+        Return the time series binned by time_delta (in seconds) in pyramid mode. The events
+        are binned by the finest resolution once per DataFrame, and every other resolution is
+        derived from that level and kept in memory for as long as the DataFrame exists.
+
+        '''
+
+        finest = self.resolutions[0]
+        if time_delta % finest != 0:
+            raise ValueError(f'Time delta {time_delta}s is not a multiple of the finest resolution {finest}s.')
+
+        # Data appended to the DataFrame invalidates its levels
+        version = (tuple(sorted(self.base_action.items())), sum(map(len, dfs.appended.values())))
+        levels = _pyramids.setdefault(dfs, {})
+        if (version, finest) not in levels:
+            levels[(version, finest)] = self._bin(dfs, finest)
+        if (version, time_delta) not in levels:
+            logger.debug(f'Deriving {time_delta}s time series from {finest}s')
+            fine = levels[(version, finest)]
+            coarse = {}
+            for platform, matrix in fine.items():
+                min_time, max_time = dfs.get_time_range(platform)
+                aggregation = _aggregation_matrix(matrix.shape[1], min_time, max_time, finest, time_delta)
+                coarse[platform] = (matrix @ aggregation).tocsc()
+            levels[(version, time_delta)] = coarse
+        return levels[(version, time_delta)]
+
+    def compute_window(self, dfs, start_date, end_date):
+        '''
+
+        Return the columns of the time series from the bin of start_date up to, but not including,
+        the bin of end_date, the same as slicing the result of compute() by get_time_bins of both
+        dates. Only the events in those bins are binned, so replaying a short window of a long
+        history does not bin all of it. In pyramid mode the window is sliced from the stored level.
+
+        '''
+
+        res = self.compute_resolution(dfs, self.time_delta) if self.resolutions else None
+        windows = {}
+        for platform in dfs.get_platforms():
             min_time, max_time = dfs.get_time_range(platform)
             time_steps = int(_get_time_bins(max_time, min_time, self.time_delta) + 1)
+            # Slicing a range gives the columns ts[:, start:end] selects, with negative and out of range bounds
+            steps = range(time_steps)[int(_get_time_bins(start_date, min_time, self.time_delta)):
+                                      int(_get_time_bins(end_date, min_time, self.time_delta))]
+            if res is not None:
+                windows[platform] = res[platform][:, steps.start:steps.stop]
+                continue
+
+            # Events lie within one time delta of the bounds of their bin, so this slice holds all events of the window
+            df = dfs.slice_time(platform, min_time + (steps.start - 1) * self.time_delta,
+                                min_time + (steps.stop + 1) * self.time_delta)
+            windows[platform] = _process_function(df, dfs.get_node_map(platform), min_time, self.time_delta,
+                                                  len(steps), self.base_action[platform], first_step=steps.start)
+        return windows
+
+    # Bin the base events of every platform by time_delta
+    def _bin(self, dfs, time_delta):
+        res = {}
+        for platform in dfs.get_platforms():
+            min_time, max_time = dfs.get_time_range(platform)
+            time_steps = int(_get_time_bins(max_time, min_time, time_delta) + 1)
             node_map = dfs.get_node_map(platform)
 
+            res[platform] = _process_function(dfs.get_df(platform), node_map, min_time, time_delta,
+                                              time_steps, self.base_action[platform])
+
+        return res
+
+    def append(self, res, dfs, platform, new_rows):
+        '''
+
+        Update the result of compute() in place for rows appended to a platform with DataFrame.append().
+        Users new to the node map get empty rows and activity after the previous time range gets new
+        columns, so only the appended rows are binned. Rows that start before all previous data shift
+        every time bin, in which case the platform is computed again.
+
+        '''
+
+        min_time, max_time = dfs.get_time_range(platform)
+        time_steps = int(_get_time_bins(max_time, min_time, self.time_delta) + 1)
+        node_map = dfs.get_node_map(platform)
+        if len(new_rows) and new_rows['nodeTime'].min() <= min_time:
             res[platform] = _process_function(dfs.get_df(platform), node_map, min_time, self.time_delta,
-                                                    time_steps, self.base_action[platform])
+                                              time_steps, self.base_action[platform])
+            return res
 
+        shape = (len(node_map), time_steps)
+        res[platform] = grow_sparse(res[platform], shape) + _process_function(
+            new_rows, node_map, min_time, self.time_delta, time_steps, self.base_action[platform])
         return res
 
 
-def _process_function(df, node_map, min_time, time_delta, time_steps, base_action, *args, **kwargs):
+# Bin the base events of df into time_steps columns, the first of which is the bin first_step after min_time
+def _process_function(df, node_map, min_time, time_delta, time_steps, base_action, first_step=0, *args, **kwargs):
     df = df[df['actionType'] == base_action]
-    data = np.ones(len(df))
-    row_ind = np.searchsorted(node_map, df.nodeUserID)
-    col_ind = np.maximum(_get_time_bins(df.nodeTime, min_time, time_delta), np.zeros(len(df)))
-    return ss.csc_matrix((data, (row_ind, col_ind)), shape=(len(node_map), time_steps), dtype=np.uint32)
+    row_ind = df['userIdx'].to_numpy()
+    col_ind = np.maximum(_get_time_bins(df.nodeTime.to_numpy(), min_time, time_delta), 0) - first_step
+    keep = (col_ind >= 0) & (col_ind < time_steps)
+    return ss.csc_matrix((np.ones(keep.sum()), (row_ind[keep], col_ind[keep])), shape=(len(node_map), time_steps),
+                         dtype=np.uint32)
+
+
+# Matrix mapping the columns of time series binned by fine_delta to the columns of the same series binned
+# by coarse_delta. A fine column holds exactly one multiple of fine_delta, the start of its bin, and the
+# coarse column is the one that start falls in, clamped at 0 as in _process_function.
+def _aggregation_matrix(fine_steps, min_time, max_time, fine_delta, coarse_delta):
+    coarse_steps = int(_get_time_bins(max_time, min_time, coarse_delta) + 1)
+    fine_starts = np.ceil((min_time + np.arange(fine_steps) * fine_delta) / fine_delta) * fine_delta
+    coarse_ind = np.clip(_get_time_bins(fine_starts, min_time, coarse_delta), 0, coarse_steps - 1).astype(int)
+    return ss.csr_matrix((np.ones(fine_steps, dtype=np.uint32), (np.arange(fine_steps), coarse_ind)),
+                         shape=(fine_steps, coarse_steps))
 
 
 def _get_time_bins(max_time, min_time, time_delta):
@@ -0,0 +1,145 @@
+import logging
+
+logger = logging.getLogger(__name__.split('.')[-1])
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever the normalized layout written by DataFrame.load changes, so stale copies are not read
+SCHEMA_VERSION = 2
+
+
+def cache_key(files, timezone):
+    '''
+
+    Key of the normalized copy of a primary dataset.
+
+    Parameters
+    ----------
+
+    files : list of str
+        The CSV files the dataset is read from.
+
+    timezone : str
+        The timezone nodeTimes are parsed in, as it changes the normalized nodeTime column.
+
+    Output
+    ------
+
+    A hex digest of the schema version, the timezone and the absolute path, size and mtime of every file.
+    Editing, replacing or touching any of the files gives a new key.
+
+    '''
+
+    sources = []
+    for fpath in files:
+        stat = os.stat(fpath)
+        sources.append([os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns])
+    description = json.dumps({'schema_version': SCHEMA_VERSION, 'timezone': timezone, 'sources': sources})
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def read(directory, key, start_date=None, end_date=None, columns=None):
+    '''
+
+    Read the normalized copy stored under key, or return None if there is none.
+    Only the rows with start_date <= nodeTime <= end_date and the given columns are read.
+
+    Numeric columns are memory-mapped. String and categorical columns are stored as int32
+    codes into a fixed-width table of their unique values. String columns are decoded back
+    to object columns, so the result has the same schema as a freshly parsed dataset.
+
+    '''
+
+    path = os.path.join(directory, key)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('schema_version') != SCHEMA_VERSION:
+        return None
+
+    # Copies are sorted by nodeTime, so the window is a contiguous range of rows
+    node_times = np.load(os.path.join(path, 'nodeTime.npy'), mmap_mode='r')
+    lower, upper = window_bounds(node_times, start_date, end_date)
+
+    data = {}
+    for name, kind in meta['columns']:
+        if columns is not None and name not in columns:
+            continue
+        if kind == 'numeric':
+            data[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')[lower:upper]
+        else:
+            codes = np.load(os.path.join(path, name + '.codes.npy'), mmap_mode='r')[lower:upper]
+            categories = np.load(os.path.join(path, name + '.categories.npy'), allow_pickle=kind == 'object')
+            if kind == 'category':
+                data[name] = pd.Categorical.from_codes(codes, categories.astype(object))
+                continue
+            # Missing values have code -1, which picks the trailing NaN
+            categories = np.append(categories.astype(object), np.nan)
+            data[name] = categories[codes]
+    return pd.DataFrame(data, copy=False)
+
+
+def window_bounds(node_times, start_date=None, end_date=None):
+    '''
+
+    Return the row range [lower, upper) of sorted node_times with start_date <= nodeTime <= end_date.
+
+    '''
+
+    lower = 0 if start_date is None else int(np.searchsorted(node_times, start_date, side='left'))
+    upper = len(node_times) if end_date is None else int(np.searchsorted(node_times, end_date, side='right'))
+    return lower, max(lower, upper)
+
+
+def write(directory, key, df):
+    '''
+
+    Store the normalized copy of a primary dataset under key. Files are written to a
+    temporary directory first and moved in place, so concurrent runs never read a
+    partial copy. Failures are logged and otherwise ignored.
+
+    '''
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=directory, prefix='.' + key)
+        columns = []
+        for name in df.columns:
+            values = df[name]
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                np.save(os.path.join(staging, name + '.npy'), values.to_numpy())
+                columns.append([name, 'numeric'])
+                continue
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                kind = 'category'
+                codes, categories = values.cat.codes.to_numpy(), values.cat.categories.to_numpy().astype(str)
+            else:
+                codes, categories = pd.factorize(values)
+                if pd.api.types.infer_dtype(categories, skipna=True) in ('string', 'empty'):
+                    kind = 'string'
+                    categories = categories.to_numpy().astype(str)
+                else:
+                    kind = 'object'
+                    categories = categories.to_numpy()
+            np.save(os.path.join(staging, name + '.codes.npy'), codes.astype(np.int32))
+            np.save(os.path.join(staging, name + '.categories.npy'), categories, allow_pickle=kind == 'object')
+            columns.append([name, kind])
+
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump({'schema_version': SCHEMA_VERSION, 'rows': len(df), 'columns': columns}, f)
+        try:
+            os.rename(staging, os.path.join(directory, key))
+        except OSError:
+            # Another run stored the same copy first
+            shutil.rmtree(staging, ignore_errors=True)
+    except Exception:
+        logger.warning(f'Could not write ingest cache to {directory}', exc_info=True)
@@ -2,13 +2,36 @@ import logging
 
 logger = logging.getLogger(__name__.split('.')[-1])
 
+import os
+import threading
 import time
-from datetime import datetime
 from os import listdir
 from os.path import isfile, join, isdir
+import numpy as np
 import pandas as pd
 import sys
 import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from dask.utils import parse_bytes
+
+from dataframe import ColumnarCache
+from dataframe.NdjsonRecords import NdjsonRecords, is_ndjson
+
+# Formats string nodeTimes are detected from, in order of preference
+NODE_TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%SZ']
+
+# Types primary CSV columns are read as. IDs are kept as strings even if they look numeric, and actionType
+# becomes categorical once the files of a dataset are merged. nodeTime is parsed to float64 epoch seconds.
+CSV_SCHEMA = {'nodeID': str, 'nodeUserID': str, 'parentID': str, 'rootID': str, 'actionType': str}
+
+# Columns whose strings are interned to int64 keys by the DataFrame, see IdTable
+ID_COLUMNS = ['nodeID', 'parentID', 'rootID']
+
+# Rows per chunk when CSVs are filtered by time while they are read
+CSV_CHUNK_SIZE = 1000000
 
 
 class DataFrame:
@@ -24,22 +47,93 @@ class DataFrame:
         with that identifier. Generally, if the data is primary (CSV, and following the PNNL format), the 
         identifier should be the name of the platform that data originates from.
 
+    timezone : str (default : 'local')
+        Timezone string nodeTimes are interpreted in before they are converted to epoch seconds, see
+        parse_node_times().
+
+    cache_directory : str (default : None)
+        Directory to keep normalized columnar copies of CSV datasets in, see load().
+
+    n_workers : int (default : 0)
+        Number of threads the files of a directory are read with, see load().
+
+    start_date, end_date, columns : (default : None)
+        Time window in epoch seconds and columns CSV datasets are restricted to while they are read, see load().
+
+    json_keys : dict (default : None)
+        Dictionary of data identifiers to the keys their NDJSON records are restricted to, see load().
+
+    memory_budget : int or str (default : 0)
+        Bytes, or a string such as '8GB', the loaded datasets may take up. When loading a dataset exceeds it,
+        the least recently used datasets are dropped from memory. 0 means no limit.
+
     Notes
     -----
 
     Currently the DataFrame takes CSV or JSON. If CSV is passed in, the DataFrame assumes it is a primary dataset
     associated with a platform and stores it as a Pandas Dataframe. If JSON is passed in, the DataFrame isolates it 
     from the CSVs, preventing the identifier from being associated with actual platforms, and stores the data as a 
-    dictionary. JSON data must be called explicitly from get_df(), and the identifier will not show up when
-    get_platforms() is called.
+    dictionary. Newline-delimited JSON is detected from the first line of a file and is not read up front;
+    it is stored as NdjsonRecords, which read the records lazily every time they are iterated. JSON data must
+    be called explicitly from get_df(), and the identifier will not show up when get_platforms() is called.
+
+    Datasets are loaded the first time they are asked for, by get_df(), get_node_map() or get_time_range().
+    Dropped datasets are loaded again when asked for, which reads the copy in the ingest cache if
+    cache_directory is set. Node maps are kept, so they are the same whenever a dataset is loaded.
+
+    Every primary dataset gets an int32 userIdx column with the index of the event's nodeUserID in the
+    platform's node map, so archetypes can index matrices by user without hashing the IDs again.
+
+    The nodeID, parentID and rootID columns of primary datasets hold int64 keys into id_table, an IdTable
+    shared by all platforms, so joins on them compare integers. Missing IDs have key -1. Use
+    IdTable.categorical() to hand rows to the OutputWriter, which restores the strings.
 
     '''
 
-    def __init__(self, fpaths, **kwargs):
+    def __init__(self, fpaths, timezone='local', cache_directory=None, n_workers=0, start_date=None, end_date=None,
+                 columns=None, json_keys=None, memory_budget=0, **kwargs):
         logger.info('Initializing dataframe.')
-        self.dataframes = load(fpaths)
-        self.node_maps = _generate_node_maps(self.dataframes)
-        self.reverse_node_maps = _generate_reverse_node_map(self.node_maps)
+        for path in fpaths.values():
+            _dataset_files(path)
+        self.fpaths = dict(fpaths)
+        self.load_options = {'timezone': timezone, 'cache_directory': cache_directory, 'n_workers': n_workers,
+                             'start_date': start_date, 'end_date': end_date, 'columns': columns,
+                             'json_keys': json_keys}
+        self.memory_budget = parse_bytes(memory_budget) if isinstance(memory_budget, str) else memory_budget
+        self._init_residency()
+
+    # Loaded datasets, least recently used first, and what is derived from them
+    def _init_residency(self):
+        self.dataframes = OrderedDict()
+        self.time_indexes = {}
+        self.sizes = {}
+        self.node_maps = {}
+        self.reverse_node_maps = {}
+        self.id_table = IdTable()
+        self.appended = {}
+        self.lock = threading.RLock()
+
+    # Only the description of the data is pickled, with the size and mtime of its files, so pickles are small
+    # and stable whichever datasets happen to be loaded. Unpickled DataFrames load the data again when needed.
+    # Node maps of datasets with appended data are kept, as they are no longer sorted.
+    def __getstate__(self):
+        sources = {key: [ColumnarCache.cache_key(_dataset_files(path), self.load_options['timezone'])
+                         for path in self._dataset_paths(key)] for key in self.fpaths}
+        return {'fpaths': self.fpaths, 'load_options': self.load_options, 'memory_budget': self.memory_budget,
+                'appended': self.appended, 'node_maps': {key: self.node_maps[key] for key in self.appended},
+                'sources': sources}
+
+    def __setstate__(self, state):
+        self.fpaths = state['fpaths']
+        self.load_options = state['load_options']
+        self.memory_budget = state['memory_budget']
+        self._init_residency()
+        self.appended = state['appended']
+        self.node_maps = state['node_maps']
+
+    # The data_loader path of a dataset followed by the paths appended to it
+    def _dataset_paths(self, key):
+        return [self.fpaths[key]] + self.appended.get(key, [])
 
     def get_df(self, key) -> pd.DataFrame:
         '''
@@ -55,18 +149,112 @@ class DataFrame:
         Output
         ------
 
-        This function outputs either a Pandas Dataframe (if the identifier was associated with a CSV dataset)
-        or a dictionary (if the identifier was associated with a JSON dataset).
+        This function outputs either a Pandas Dataframe (if the identifier was associated with a CSV dataset),
+        a dictionary (if the identifier was associated with a JSON dataset) or NdjsonRecords (if the identifier
+        was associated with a newline-delimited JSON dataset).
 
         '''
 
-        try:
-            return self.dataframes[key]
-        except:
+        if key not in self.fpaths:
             logger.error(
                 'Dataframe \'' + key + '\' was not loaded in config. Please add required dataframe path to config prior to runtime.',
                 exc_info=True)
             sys.exit()
+        # Archetypes computed concurrently share the DataFrame, so datasets are loaded by one thread at a time
+        with self.lock:
+            if key in self.dataframes:
+                self.dataframes.move_to_end(key)
+                return self.dataframes[key]
+
+            df = load({key: self.fpaths[key]}, **self.load_options)[key]
+            if isinstance(df, pd.DataFrame):
+                if key in self.appended:
+                    df = _merge_by_time([df] + [load({key: path}, **self.load_options)[key]
+                                                for path in self.appended[key]])
+                self._index_users(key, df)
+                _intern_ids({key: df}, self.id_table)
+                df = self._index_time(key, df)
+                self.sizes[key] = int(df.memory_usage(deep=True).sum())
+            else:
+                self.sizes[key] = 0
+            self.dataframes[key] = df
+            self._evict(keep=key)
+            return df
+
+    # Keep a view of the nodeTime column of a dataset as its time index, after checking that it is sorted
+    def _index_time(self, key, df):
+        node_times = df['nodeTime'].to_numpy()
+        if np.any(node_times[1:] < node_times[:-1]):
+            logger.warning(f'{key} is not sorted by nodeTime, sorting it')
+            df = df.sort_values(by=['nodeTime'], kind='stable').reset_index(drop=True)
+            node_times = df['nodeTime'].to_numpy()
+        self.time_indexes[key] = node_times
+        return df
+
+    def append(self, key, fpath):
+        '''
+
+        Merge new data into a primary dataset, such as the next day of a feed.
+
+        Parameters
+        ----------
+
+        key : str
+            The identifier of the platform the data belongs to.
+
+        fpath : str
+            A CSV file or a directory of CSV files, in the same format as the data_loader entries.
+
+        Output
+        ------
+
+        The appended rows, with their userIdx column and interned IDs. Pass them to the append() method of
+        archetypes to update their results for the new data.
+
+        Notes
+        -----
+
+        Users that are new to the platform are added to the end of its node map, so the indices of existing
+        users, and the rows of matrices indexed by them, do not change. The path is remembered, so the data
+        is appended again whenever the dataset is reloaded.
+
+        '''
+
+        df = self.get_df(key)
+        new_rows = load({key: fpath}, **self.load_options)[key]
+        self._index_users(key, new_rows)
+        _intern_ids({key: new_rows}, self.id_table)
+        self.appended.setdefault(key, []).append(fpath)
+
+        self.dataframes[key] = self._index_time(key, _merge_by_time([df, new_rows]))
+        self.sizes[key] = int(self.dataframes[key].memory_usage(deep=True).sum())
+        self._evict(keep=key)
+        return new_rows
+
+    # Set the userIdx column of rows of a dataset. The first load builds the sorted node map, later rows
+    # add the users the node map does not hold yet to its end.
+    def _index_users(self, key, df):
+        if key not in self.node_maps:
+            self.node_maps.update(_generate_node_maps({key: df}))
+            return
+        node_map = self.node_maps[key]
+        reverse_node_map = self.get_reverse_node_map(key)
+        for user_id in sorted(set(df['nodeUserID'].unique()) - reverse_node_map.keys()):
+            reverse_node_map[user_id] = len(node_map)
+            node_map.append(user_id)
+        df['userIdx'] = df['nodeUserID'].map(reverse_node_map).to_numpy(dtype=np.int32)
+
+    # Drop the least recently used datasets until the loaded ones fit in the memory budget
+    def _evict(self, keep):
+        if not self.memory_budget:
+            return
+        for key in list(self.dataframes):
+            if sum(self.sizes[k] for k in self.dataframes) <= self.memory_budget:
+                return
+            if key != keep:
+                logger.debug(f'Evicting {key} ({self.sizes[key]} bytes) from memory')
+                del self.dataframes[key]
+                self.time_indexes.pop(key, None)
 
     def get_platforms(self):
         '''
@@ -76,11 +264,31 @@ class DataFrame:
         '''
 
         platforms = []
-        for platform in self.dataframes:
-            if isinstance(self.dataframes[platform], pd.DataFrame):
-                platforms.append(platform)
+        for key, path in self.fpaths.items():
+            if not all([('json' in fn) for fn in _dataset_files(path)]):
+                platforms.append(key)
         return platforms
 
+    def select_platforms(self, platforms):
+        '''
+
+        Return a DataFrame holding only the given platforms. Loaded data is shared with this DataFrame,
+        both ways, and data that is not associated with a platform (JSON) is kept.
+
+        Parameters
+        ----------
+
+        platforms : list of str
+            The identifiers of the platforms to keep.
+
+        '''
+
+        subset = DataFrame.__new__(DataFrame)
+        subset.__dict__.update(self.__dict__)
+        other_platforms = set(self.get_platforms()) - set(platforms)
+        subset.fpaths = {key: path for key, path in self.fpaths.items() if key not in other_platforms}
+        return subset
+
     def get_node_map(self, key):
         '''
 
@@ -94,29 +302,171 @@ class DataFrame:
 
         '''
 
+        if key not in self.node_maps:
+            self.get_df(key)
         return self.node_maps[key]
 
     def get_reverse_node_map(self, key):
+        '''
+
+        Return a dictionary of nodeUserIDs to their index in the node map. It is built on first use,
+        as the userIdx column of the primary dataset already holds the index of every event's user.
+
+        '''
+
+        if key not in self.reverse_node_maps:
+            self.reverse_node_maps[key] = _generate_reverse_node_map({key: self.get_node_map(key)})[key]
         return self.reverse_node_maps[key]
 
+    def get_time_index(self, key):
+        '''
+
+        Return the nodeTime column of a primary dataset as a sorted NumPy array. It is a view of the
+        dataset, so row i of the index is row i of get_df(key).
+
+        '''
+
+        self.get_df(key)
+        return self.time_indexes[key]
+
+    def slice_time(self, key, start=None, end=None):
+        '''
+
+        Return the rows of a primary dataset with start <= nodeTime < end, found by binary search on the
+        time index. The rows are a contiguous slice of the dataset, which Pandas returns without copying.
+
+        Parameters
+        ----------
+
+        key : str
+            The key (identifier) of the platform.
+
+        start, end : float (default : None)
+            Epoch seconds bounding the window. None leaves that side of the window open.
+
+        '''
+
+        df = self.get_df(key)
+        lower, upper = time_bounds(self.time_indexes[key], start, end)
+        return df.iloc[lower:upper]
+
     def get_time_range(self, key):
-        t_start = self.dataframes[key]['nodeTime'].iloc[0]
-        t_end = self.dataframes[key]['nodeTime'].iloc[-1]
+        node_times = self.get_time_index(key)
+        t_start = node_times[0]
+        t_end = node_times[-1]
         logger.debug(f'{key} has time range {t_start} - {t_end}')
         return t_start, t_end
 
 
-# Given a primary dataset (loaded in as a Pandas Dataframe), extract all unique nodeUserIDs and store them in a sorted list
+def time_bounds(node_times, start=None, end=None, closed='left'):
+    '''
+
+    Return the row range [lower, upper) of the times in a sorted array that fall in a window.
+
+    Parameters
+    ----------
+
+    node_times : 1D array
+        Sorted times.
+
+    start, end : float (default : None)
+        Bounds of the window. None leaves that side of the window open.
+
+    closed : str (default : 'left')
+        Which bounds belong to the window: 'left', 'right', 'both' or 'neither'.
+
+    '''
+
+    lower, upper = 0, len(node_times)
+    if start is not None:
+        lower = int(np.searchsorted(node_times, start, side='left' if closed in ('left', 'both') else 'right'))
+    if end is not None:
+        upper = int(np.searchsorted(node_times, end, side='right' if closed in ('right', 'both') else 'left'))
+    return lower, max(lower, upper)
+
+
+class IdTable:
+    '''
+
+    Table of interned ID strings. Every distinct string gets an int64 key, its position in the table,
+    and missing values get the key -1.
+
+    '''
+
+    def __init__(self):
+        self.ids = pd.Index([], dtype=object)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, values):
+        '''
+
+        Return the int64 keys of an array of ID strings, adding strings not yet in the table.
+
+        '''
+
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        keys = self.ids.get_indexer(uniques)
+        new = keys == -1
+        keys[new] = np.arange(len(self.ids), len(self.ids) + new.sum())
+        self.ids = self.ids.append(pd.Index(uniques[new], dtype=object))
+        return np.where(codes == -1, -1, keys[codes]).astype(np.int64)
+
+    def decode(self, keys):
+        '''
+
+        Return the ID strings of an array of keys as an object array, with NaN for key -1.
+
+        '''
+
+        keys = np.asarray(keys)
+        ids = np.asarray(self.ids, dtype=object)[keys]
+        ids[keys == -1] = np.nan
+        return ids
+
+    def categorical(self, keys):
+        '''
+
+        Return an array of keys as a Pandas Categorical over the table. This restores the ID strings
+        without copying them, and is how interned columns are passed to the OutputWriter.
+
+        '''
+
+        return pd.Categorical.from_codes(np.asarray(keys), dtype=pd.CategoricalDtype(self.ids))
+
+
+# Replace the ID columns of every primary dataset by their keys in id_table, interning all of them in one pass
+def _intern_ids(dataframes, id_table):
+    columns = [df[name] for df in dataframes.values() if isinstance(df, pd.DataFrame)
+               for name in ID_COLUMNS if name in df]
+    if not columns:
+        return
+    keys = id_table.intern(np.concatenate([column.to_numpy(dtype=object) for column in columns]))
+    offset = 0
+    for df in dataframes.values():
+        if not isinstance(df, pd.DataFrame):
+            continue
+        for name in ID_COLUMNS:
+            if name in df:
+                df[name] = keys[offset:offset + len(df)]
+                offset += len(df)
+
+
+# Given a primary dataset (loaded in as a Pandas Dataframe), extract all unique nodeUserIDs and store them in a sorted
+# list, and add the int32 userIdx column holding the index of every event's user in that list
 def _generate_node_maps(dataframes):
     node_maps = {}
     for key in dataframes:
         df = dataframes[key]
         if isinstance(df, dict):
             continue
-        elif isinstance(df, list):
+        elif isinstance(df, (list, NdjsonRecords)):
             continue
         elif isinstance(df, pd.DataFrame):
-            node_maps[key] = sorted(df['nodeUserID'].unique().tolist())
+            codes, uniques = pd.factorize(df['nodeUserID'], sort=True)
+            df['userIdx'] = codes.astype(np.int32)
+            node_maps[key] = uniques.tolist()
         else:
             logger.error('Loaded dataframe does not have correct datatype. ' +
                          f'Instead has type of "{type(df).__name__}". Please rectify in config prior to runtime.',
@@ -133,61 +483,226 @@ def _generate_reverse_node_map(node_maps):
     return reverse_node_maps
 
 
-def load(fpaths):
+def load(fpaths, timezone='local', cache_directory=None, n_workers=0, start_date=None, end_date=None, columns=None,
+         json_keys=None):
+    '''
+
+    Load every dataset of fpaths. CSV datasets have their nodeTimes parsed with parse_node_times()
+    and are sorted by nodeTime, JSON datasets are returned as parsed.
+
+    Parameters
+    ----------
+
+    fpaths : dict
+        Dictionary of data identifiers to a file or a directory of files, see DataFrame.
+
+    timezone : str (default : 'local')
+        Timezone string nodeTimes are interpreted in.
+
+    cache_directory : str (default : None)
+        If given, a normalized columnar copy of every CSV dataset is stored here on first load, and read
+        instead of the CSVs as long as they do not change, see ColumnarCache.
+
+    n_workers : int (default : 0)
+        Number of threads the files of a directory are read with. 0 uses one per CPU.
+
+    start_date, end_date : float (default : None)
+        If given, only events with start_date <= nodeTime <= end_date (epoch seconds) are kept.
+
+    columns : list of str (default : None)
+        If given, only these columns of CSV datasets are kept. nodeUserID and nodeTime are always kept.
+
+    json_keys : dict (default : None)
+        Dictionary of data identifiers to the keys records of their NDJSON files are restricted to.
+
+    Notes
+    -----
+
+    CSV columns are typed by CSV_SCHEMA. Every file is parsed and sorted by nodeTime on its own, and the
+    sorted files are then merged, so a directory never has to be sorted as a whole.
+
+    The time window and columns are applied while reading: CSVs are read in chunks of which only the rows
+    in the window are kept, and copies in the ingest cache, which are sorted by nodeTime, are sliced by a
+    binary search on their memory-mapped nodeTime column. Copies are always of the full dataset, so they
+    are shared by runs with different windows.
+
+    '''
+
+    json_keys = json_keys or {}
+    if columns is not None:
+        columns = list(columns) + [name for name in ['nodeUserID', 'nodeTime'] if name not in columns]
+    window = (start_date, end_date, columns)
+
     res = {}
     for k, v in fpaths.items():
         logger.info(f'Loading {k}')
-        is_json = False
-        if isfile(v):
-            if 'json' in v:
-                is_json = True
-                try:
-                    with open(v) as f:
-                        data = json.load(f)
-                    res[k] = data
-                except:
-                    l_data = []
-                    with open(v) as f:
-                        for line in f:
-                            l_data.append(json.loads(line))
-                    res[k] = l_data
-            else:
-                res[k] = pd.read_csv(v)
-        elif isdir(v):
-            files = _get_files(v)
-            if all([('json' in fn) for fn in files]):
-                is_json = True
-                try:
-                    res[k] = {}
-                    for fn in files:
-                        with open(fn) as f:
-                            res[k].update(json.load(f))
-                except:
-                    res[k] = []
-                    for fn in files:
-                        l_data = []
-                        with open(fn) as f:
-                            for line in f:
-                                l_data.append(json.loads(line))
-                        res[k] += l_data
-            else:
-                res[k] = pd.concat(map(pd.read_csv, _get_files(v)))
-        else:
-            logger.error(
-                'Path \'' + v + '\' does not exist. Please add correct dataframe path to config prior to runtime.',
-                exc_info=True)
-            sys.exit()
-        if not is_json:
-            if isinstance(res[k]['nodeTime'].iloc[0], str):
-                try:
-                    res[k]['nodeTime'] = res[k]['nodeTime'].apply(
-                        lambda x: time.mktime(datetime.strptime(x, '%Y-%m-%d %H:%M:%S').timetuple()))
-                except ValueError:
-                    res[k]['nodeTime'] = res[k]['nodeTime'].apply(
-                        lambda x: time.mktime(datetime.strptime(x, '%Y-%m-%dT%H:%M:%SZ').timetuple()))
-            res[k] = res[k].sort_values(by=['nodeTime'])
+        files = _dataset_files(v)
+
+        if all([('json' in fn) for fn in files]):
+            res[k] = _load_json(files, single=isfile(v), keys=json_keys.get(k))
+            continue
+
+        key = None
+        if cache_directory:
+            key = ColumnarCache.cache_key(files, timezone)
+            df = ColumnarCache.read(cache_directory, key, *window)
+            if df is not None:
+                logger.debug(f'Read {k} from ingest cache {key}')
+                res[k] = df
+                continue
+
+        # The cached copy holds the full dataset, so the window is applied after it is written
+        read_file = partial(_read_primary, timezone=timezone, window=window if key is None else (None, None, None))
+        with ThreadPoolExecutor(min(n_workers or os.cpu_count(), len(files))) as pool:
+            frames = list(pool.map(read_file, files))
+        res[k] = _merge_by_time(frames)
+        if key is not None:
+            ColumnarCache.write(cache_directory, key, res[k])
+            res[k] = _select(res[k], *window)
     return res
 
 
+# Read one primary CSV file with the declared schema, sorted by nodeTime and restricted to a time window and columns
+def _read_primary(fpath, timezone, window):
+    start_date, end_date, columns = window
+    usecols = None if columns is None else columns.__contains__
+    if start_date is None and end_date is None:
+        chunks = [pd.read_csv(fpath, dtype=CSV_SCHEMA, usecols=usecols)]
+    else:
+        chunks = pd.read_csv(fpath, dtype=CSV_SCHEMA, usecols=usecols, chunksize=CSV_CHUNK_SIZE)
+
+    frames = []
+    for chunk in chunks:
+        chunk['nodeTime'] = parse_node_times(chunk['nodeTime'], timezone=timezone).astype(np.float64)
+        if start_date is not None:
+            chunk = chunk[chunk['nodeTime'] >= start_date]
+        if end_date is not None:
+            chunk = chunk[chunk['nodeTime'] <= end_date]
+        frames.append(chunk)
+    df = frames[0] if len(frames) == 1 else pd.concat(frames)
+    return df.sort_values(by=['nodeTime'], kind='stable')
+
+
+# Restrict a dataset sorted by nodeTime to a time window and columns
+def _select(df, start_date, end_date, columns):
+    lower, upper = ColumnarCache.window_bounds(df['nodeTime'].to_numpy(), start_date, end_date)
+    if columns is not None:
+        df = df[[name for name in df.columns if name in columns]]
+    return df.iloc[lower:upper].reset_index(drop=True)
+
+
+# Merge frames sorted by nodeTime into one sorted frame, keeping equal times in file order
+def _merge_by_time(frames):
+    runs = [(frame['nodeTime'].to_numpy(), np.arange(len(frame))) for frame in frames]
+    offset = 0
+    for i, (times, order) in enumerate(runs):
+        runs[i] = (times, order + offset)
+        offset += len(times)
+
+    # Merge neighbouring runs pairwise until one is left, which takes log2(len(frames)) passes over the data
+    while len(runs) > 1:
+        merged = [_merge_runs(*runs[i], *runs[i + 1]) for i in range(0, len(runs) - 1, 2)]
+        runs = merged + runs[len(runs) - len(runs) % 2:]
+
+    df = pd.concat(frames, ignore_index=True).take(runs[0][1]).reset_index(drop=True)
+    if 'actionType' in df:
+        df['actionType'] = df['actionType'].astype('category')
+    return df
+
+
+# Merge two sorted time arrays along with their row indices. Ties go to the first run.
+def _merge_runs(times_a, order_a, times_b, order_b):
+    n = len(times_a) + len(times_b)
+    pos_b = np.searchsorted(times_a, times_b, side='right') + np.arange(len(times_b))
+    from_a = np.ones(n, dtype=bool)
+    from_a[pos_b] = False
+    times = np.empty(n, dtype=np.float64)
+    order = np.empty(n, dtype=np.int64)
+    times[pos_b], order[pos_b] = times_b, order_b
+    times[from_a], order[from_a] = times_a, order_a
+    return times, order
+
+
+# Read one JSON document per file, or lazily read the records of NDJSON files
+def _load_json(files, single, keys=None):
+    if any(is_ndjson(fn) for fn in files):
+        return NdjsonRecords(files, keys=keys)
+    if single:
+        with open(files[0]) as f:
+            return json.load(f)
+    data = {}
+    for fn in files:
+        with open(fn) as f:
+            data.update(json.load(f))
+    return data
+
+
+def parse_node_times(node_times, timezone='local', sample_size=100):
+    '''
+
+    Convert a column of nodeTimes to epoch seconds in one vectorized pass.
+
+    Parameters
+    ----------
+
+    node_times : pd.Series
+        The nodeTime column. Numeric columns are taken to hold epoch seconds already and
+        are returned unchanged, as are strings holding numbers.
+
+    timezone : str (default : 'local')
+        Timezone the times are interpreted in. 'local' uses the system timezone, as
+        time.mktime() does, and any other value is passed to Pandas (e.g. 'UTC').
+
+    sample_size : int (default : 100)
+        Number of values the format is detected from, among NODE_TIME_FORMATS.
+
+    '''
+
+    if pd.api.types.is_numeric_dtype(node_times):
+        return node_times
+    sample = node_times.dropna().iloc[:sample_size]
+    if pd.to_numeric(sample, errors='coerce').notna().all():
+        return pd.to_numeric(node_times)
+
+    for time_format in NODE_TIME_FORMATS:
+        try:
+            pd.to_datetime(sample, format=time_format)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError(f'nodeTime values such as \'{sample.iloc[0]}\' match none of the formats {NODE_TIME_FORMATS}.')
+
+    if time_format.endswith('Z'):
+        # Pandas only takes its fast path for formats without literal suffixes
+        node_times, time_format = node_times.str[:-1], time_format[:-1]
+    parsed = pd.to_datetime(node_times, format=time_format)
+    if timezone != 'local':
+        return _epoch_seconds(parsed.dt.tz_localize(timezone))
+
+    # The local UTC offset only changes on minute boundaries, so mktime is called once per distinct minute, which
+    # also resolves times that are ambiguous or skipped around DST changes exactly as before
+    minutes, inverse = np.unique(parsed.values.astype('datetime64[m]'), return_inverse=True)
+    local = np.array([time.mktime(m.timetuple()) for m in minutes.astype(object)])
+    offsets = minutes.astype(np.int64) * 60 - local
+    return pd.Series(_epoch_seconds(parsed) - offsets[inverse], index=node_times.index)
+
+
+def _epoch_seconds(times):
+    return np.asarray((times - pd.Timestamp(0, tz=getattr(times.dtype, 'tz', None))) / pd.Timedelta(seconds=1))
+
+
+# The files of a data_loader entry, which is a file or a directory of files
+def _dataset_files(fpath):
+    if isfile(fpath):
+        return [fpath]
+    if isdir(fpath):
+        return _get_files(fpath)
+    logger.error(
+        'Path \'' + fpath + '\' does not exist. Please add correct dataframe path to config prior to runtime.',
+        exc_info=True)
+    sys.exit()
+
+
 def _get_files(fpath):
-    return [fpath + f for f in listdir(fpath) if isfile(join(fpath, f))]
+    return [fpath + f for f in sorted(listdir(fpath)) if isfile(join(fpath, f))]
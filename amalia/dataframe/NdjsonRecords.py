@@ -0,0 +1,98 @@
+import logging
+
+logger = logging.getLogger(__name__.split('.')[-1])
+
+import json
+from itertools import islice
+
+import pandas as pd
+
+
+class NdjsonRecords:
+    '''
+
+    Lazily read records of newline-delimited JSON files. Files are read line by line every time the
+    records are iterated, so memory use does not depend on the size of the files.
+
+    Parameters
+    ----------
+
+    files : list of str
+        The NDJSON files, read in order.
+
+    keys : list of str (default : None)
+        If given, records only hold these keys. Keys missing from a record are set to None.
+
+    Notes
+    -----
+
+    Iterating yields one dictionary per record, as the list DataFrame used to hold. Use iter_chunks()
+    or to_frame() to get the records as Pandas DataFrames instead.
+
+    '''
+
+    def __init__(self, files, keys=None):
+        self.files = list(files)
+        self.keys = None if keys is None else list(keys)
+
+    def __iter__(self):
+        for fpath in self.files:
+            with open(fpath) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if self.keys is not None:
+                        record = {key: record.get(key) for key in self.keys}
+                    yield record
+
+    def iter_chunks(self, chunk_size=100000):
+        '''
+
+        Yield the records as Pandas DataFrames of up to chunk_size rows.
+
+        '''
+
+        records = iter(self)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                return
+            yield pd.DataFrame.from_records(chunk, columns=self.keys)
+
+    def to_frame(self):
+        '''
+
+        Return all records as one Pandas DataFrame.
+
+        '''
+
+        chunks = list(self.iter_chunks())
+        if not chunks:
+            return pd.DataFrame(columns=self.keys)
+        return pd.concat(chunks, ignore_index=True)
+
+
+def is_ndjson(fpath):
+    '''
+
+    Tell newline-delimited JSON from a JSON document by the first line of a file. The file is NDJSON
+    if its first line is a complete JSON object and more content follows it.
+
+    '''
+
+    with open(fpath) as f:
+        first_line = f.readline()
+        if not first_line.lstrip().startswith('{'):
+            return False
+        try:
+            json.loads(first_line)
+        except ValueError:
+            return False
+        # A file holding a single one-line document is not NDJSON
+        while True:
+            block = f.read(4096)
+            if not block:
+                return False
+            if block.strip():
+                return True
@@ -1,7 +1,5 @@
 import logging
 
-from tools.Utilities import get_time_bins
-
 logger = logging.getLogger(__name__.split('.')[-1])
 
 from archetypes.TimeSeriesArchetype import TimeSeriesArchetype
@@ -52,20 +50,14 @@ class ReplayTimeSeriesFeature:
 
     @Cache.amalia_cache
     def compute(self, dfs):
-        ts = TimeSeriesArchetype(self.cfg).compute(dfs)
-
-        for platform, e in ts.items():
-            total_base_events = e.sum()
-            logger.debug(f'Total time series events for {platform} is {total_base_events}')
+        # Only the replayed segment of the time series is binned
+        ts = TimeSeriesArchetype(self.cfg).compute_window(dfs, self.start_date, self.end_date)
 
         res = {}
         logger.info('Replaying time series segment.')
         for platform in ts:
-            min_time, max_time = dfs.get_time_range(platform)
-            start = int(get_time_bins(self.start_date, min_time, self.time_delta))
-            end = int(get_time_bins(self.end_date, min_time, self.time_delta))
-            logger.debug(f"Got start: {start} and end: {end} for {platform}. These will index a timeseries of shape {ts[platform].shape}")
-            res[platform] = ts[platform][:, start:end].tocsr()
+            logger.debug(f'Got a timeseries segment of shape {ts[platform].shape} for {platform}')
+            res[platform] = ts[platform].tocsr()
 
             if res[platform].sum() == 0:
                 logger.warning(f'No events replayed for {platform}')
@@ -7,6 +7,8 @@ logger = logging.getLogger(__name__.split('.')[-1])
 from archetypes.ResponseTypeArchetype import ResponseTypeArchetype
 from archetypes.TimeSeriesArchetype import TimeSeriesArchetype
 import tools.Cache as Cache
+from tools.Graph import get_graph
+from tools.Utilities import scale_rows
 
 class ResponseTypeFeature:
     '''
@@ -18,6 +20,10 @@ class ResponseTypeFeature:
     
     act : 1D float array
         This variable contains each user's total baseline activity.          
+
+    dtype : str
+        Config-defined float type the probabilities are stored as. float32
+        halves the memory of the matrices, at the cost of precision.
     
     Output
     ----------
@@ -29,20 +35,28 @@ class ResponseTypeFeature:
     activity of j. 
     '''
 
+    dependencies = [TimeSeriesArchetype, ResponseTypeArchetype]
+
     def __init__(self, cfg):
         self.cfg = cfg
+        self.dtype = np.dtype(cfg.get('response_type_feature.dtype', default='float64'))
     
     @Cache.amalia_cache
     def compute(self, dfs):
-        ts = TimeSeriesArchetype(self.cfg).compute(dfs)
-        rc = ResponseTypeArchetype(self.cfg).compute(dfs)
+        graph = get_graph(self.cfg, dfs)
+        ts = graph.get(TimeSeriesArchetype)
+        rc = graph.get(ResponseTypeArchetype)
         res = {}
         logger.info('Calculating response probabilities.')
         for platform in ts:            
-            act = ts[platform].sum(axis=1, dtype=float)
-            act = np.fromiter(map(lambda x: x if x != 0 else 1, act), dtype=np.float)
+            act = np.asarray(ts[platform].sum(axis=1, dtype=float)).ravel()
+            act[act == 0] = 1
             act = np.reciprocal(act)
             res[platform] = {}
             for a_type in rc[platform]:
-                res[platform][a_type] = rc[platform][a_type].getH().multiply(act).getH()
+                counts = rc[platform][a_type].tocsr()
+                # Only the values are copied, as the counts are kept by the graph; the structure is shared
+                probabilities = csr_matrix((counts.data.astype(self.dtype), counts.indices, counts.indptr),
+                                           shape=counts.shape)
+                res[platform][a_type] = scale_rows(probabilities, act)
         return res
\ No newline at end of file
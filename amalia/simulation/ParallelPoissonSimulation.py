@@ -1,25 +1,23 @@
 import logging
 
-from tools.EventGeneration import convert_date, generate_random_time, generate_random_node_id
+from tools.EventGeneration import convert_date, NodeIdGenerator, EventStreams, generate_responses, stream_events
 
 logger = logging.getLogger(__name__.split('.')[-1])
 
 from features.ResponseTypeFeature import ResponseTypeFeature
 from features.ReplayTimeSeriesFeature import ReplayTimeSeriesFeature
 import tools.Cache as Cache
+from tools.Graph import get_graph
+from tools.EventBuffer import EventBuffer, SpilledEvents
 
 # Required for MapReduce functionality
-from dask import delayed
-from tools.MapReduce import map_reduce, reduce_list, partition_nodes
+from tools.MapReduce import get_executor_from_config, reduce_event_buffers, partition_nodes, partition_by_cost, \
+    map_platforms
 
-import random
-import pandas as pd
-
-import warnings
-from scipy.sparse import SparseEfficiencyWarning
-warnings.simplefilter('ignore', SparseEfficiencyWarning)
+import functools
 
-random.seed(1234)
+import numpy as np
+import pandas as pd
 
 class ParallelPoissonSimulation:
     '''
@@ -40,116 +38,188 @@ class ParallelPoissonSimulation:
         self.end_date = cfg.get("limits.end_date", type=convert_date)
         self.time_delta = cfg.get("limits.time_delta", type=pd.Timedelta).total_seconds()
         self.nodes_per_thread = cfg.get("parallel_poisson_simulation.nodes_per_thread")
+        self.partitioning = cfg.get("parallel_poisson_simulation.partitioning", 'cost')
+        self.partitions_per_worker = cfg.get("parallel_poisson_simulation.partitions_per_worker", 4)
         self.n_workers = cfg.get('dask.n_workers')
+        self.backend = cfg.get('map_reduce.backend', default='dask')
 
         if generate_replies is None:
             self.generate_replies = cfg.get("parallel_poisson_simulation.generate_replies", True)
         else:
             self.generate_replies = generate_replies
+        self.seed = cfg.get("parallel_poisson_simulation.seed", 1234)
+        self.platform_workers = cfg.get("simulation.platform_workers", 1)
 
         self.cfg = cfg
 
     @Cache.amalia_cache
     def compute(self, dfs, train_dfs=None):
-        # Retrieve replay time-series feature and response type feature
-        ts = ReplayTimeSeriesFeature(self.cfg).compute(dfs)
-        responses = ResponseTypeFeature(self.cfg).compute(dfs)
+        if self.backend == 'dask' and self.n_workers < 2:
+            logger.error('ParallelPoissonSimulation requires dask workers (>1) to run for MapReduce functionality.')
+            raise ValueError('ParallelPoissonSimulation requires dask workers (>1) to run for MapReduce functionality.')
+
+        executor = get_executor_from_config(self.cfg)
+        # The features and partitions of every platform are prepared independently, concurrently with
+        # simulation.platform_workers > 1
+        platforms = map_platforms(functools.partial(self.prepare_platform, n_workers=executor.n_workers), dfs,
+                                  self.platform_workers)
+
+        # The bins of all platforms are run in a single MapReduce job, so platforms share the workers
+        nodes = [(platform['platform'], items) for platform in platforms for items in platform['nodes']]
+
+        # Define kwargs to scatter and pass to worker function, keyed by platform
+        scatter_data_kwargs = {'ts': {p['platform']: p['ts'] for p in platforms},
+                               'node_map': {p['platform']: p['node_map'] for p in platforms}}
+        map_function_kwargs = {'start_date': self.start_date, 'generate_replies': self.generate_replies,
+                               'responses': {p['platform']: p['responses'] for p in platforms},
+                               'streams': {p['platform']: p['streams'] for p in platforms}}
+
+        # Run MapReduce on the configured backend
+        res = executor.map_reduce(nodes,
+                        _worker_generate_base_event,
+                        reduce_event_buffers,
+                        scatter_data_kwargs=scatter_data_kwargs,
+                        map_function_kwargs=map_function_kwargs)
+
+        # With the spill reduce mode the partitions stay on disk, and the output module merges them by time
+        if executor.reduce_mode == 'spill':
+            res = SpilledEvents(res, {p['platform']: p['node_map'] for p in platforms})
+
+        # Return the events sorted by time
+        # Feed into the output module for actual result generation
+        if len(res) == 0:
+            logger.error('ParallelPoissonSimulation produced no events. Terminating.')
+            raise ValueError('ParallelPoissonSimulation produced no events.')
 
-        res = []
+        return res if executor.reduce_mode == 'spill' else res.sort_by_time()
 
-        platforms = dfs.get_platforms()
-        for platform in platforms:
-            ts = ts[platform]
-            responses = responses[platform]
-            node_map = dfs.get_node_map(platform)
+    def prepare_platform(self, dfs, platform_index, platform, n_workers=1):
+        '''
 
-            # For all users that have a nonzero row in their ts, generate events
-            logger.info('Generating new events.')
-            nonzero_rows, __ = ts.nonzero()
+        Compute the features of one platform, given a DataFrame holding only that platform, and
+        partition its users into MapReduce bins for n_workers workers.
 
-            if self.n_workers < 2:
-                logger.error('ParallelPoissonSimulation requires dask workers (>1) to run for MapReduce functionality.')
-                raise ValueError('ParallelPoissonSimulation requires dask workers (>1) to run for MapReduce functionality.')
+        '''
 
-            # Partition all base event generators into bins
-            # Each Dask worker will recieve one bin and run only the ids within that bin
+        # Retrieve replay time-series feature and response type feature
+        # Both features use the time series archetype, which the graph computes once, concurrently
+        # with the response type archetype
+        graph = get_graph(self.cfg, dfs)
+        graph.run([ReplayTimeSeriesFeature, ResponseTypeFeature])
+        ts = graph.get(ReplayTimeSeriesFeature)[platform]
+        responses = graph.get(ResponseTypeFeature)[platform]
+
+        # For all users that have a nonzero row in their ts, generate events
+        logger.info(f'Partitioning users of {platform}.')
+        # Each user is visited once, however many time bins they are active in
+        nonzero_rows = np.unique(ts.nonzero()[0])
+
+        # Partition all base event generators into bins
+        # Each worker will recieve one bin and run only the work items within that bin
+        # A work item (user, first bin, last bin + 1) covers the time bins [first bin, last bin] of one user
+        if self.partitioning == 'cost':
+            # Oversubscribe the workers, so that idle workers pick up the remaining bins
+            n_bins = max(1, n_workers * self.partitions_per_worker)
+            items, costs = _build_work_items(ts, nonzero_rows, responses, n_bins)
+            nodes = partition_by_cost(costs, n_bins)
+        else:
+            items = np.column_stack((nonzero_rows, np.zeros_like(nonzero_rows), np.full_like(nonzero_rows, ts.shape[1])))
             nodes = partition_nodes(len(nonzero_rows), self.nodes_per_thread)
 
-            # Define kwargs to scatter and pass to worker function
-            scatter_data_kwargs = {'ts': ts, 'node_map': node_map}
-            map_function_kwargs = {'nonzero_node_map': nonzero_rows, 'start_date': self.start_date, 'responses': responses,
-                                'generate_replies': self.generate_replies, 'platform': platform}
-
-            # Run MapReduce
-            sub_res = map_reduce(nodes,
-                            delayed(_worker_generate_base_event),
-                            delayed(reduce_list),
-                            scatter_data_kwargs=scatter_data_kwargs,
-                            map_function_kwargs=map_function_kwargs).compute()
-            res = res + sub_res
-
-        # Return a pandas DataFrame sorted by time  
-        # Feed into the output module for actual result generation  
-        res = pd.DataFrame(res)
-
-        if len(res) == 0:
-            logger.error('ParallelPoissonSimulation produced no events. Terminating.')
-            raise ValueError('ParallelPoissonSimulation produced no events.')
-
-        return res.sort_values(by=['nodeTime']).reset_index(drop=True)
-
-
-# Worker function that each Dask worker will run
-def _worker_generate_base_event(nodes, ts, node_map, nonzero_node_map, start_date, responses, generate_replies, platform):
-    res = []
-    for root_user_id in nonzero_node_map[nodes]:
+        # Draws are keyed by event, so the result does not depend on the partitioning or the number of workers
+        return {'platform': platform, 'ts': ts, 'responses': responses, 'node_map': dfs.get_node_map(platform),
+                'streams': EventStreams(ts, responses, self.seed, platform_index),
+                'nodes': [items[bin] for bin in nodes]}
+
+    def stream(self, dfs, train_dfs=None):
+        '''
+
+        Generate the events of compute() one time bin at a time, as a generator of
+        EventBuffers in time order. Peak memory depends on the busiest time bin
+        rather than on the whole replay. Time bins are generated in the calling
+        process, and the events equal those of compute().
+
+        '''
+
+        graph = get_graph(self.cfg, dfs)
+        graph.run([ReplayTimeSeriesFeature, ResponseTypeFeature])
+        ts = graph.get(ReplayTimeSeriesFeature)
+        responses = graph.get(ResponseTypeFeature)
+
+        platforms = [(platform, ts[platform], responses[platform], dfs.get_node_map(platform),
+                      EventStreams(ts[platform], responses[platform], self.seed, platform_index), 'tweet')
+                     for platform_index, platform in enumerate(dfs.get_platforms())]
+        return stream_events(platforms, self.start_date, 86400, NodeIdGenerator(self.seed), self.generate_replies)
+
+
+# Split the nonzero rows of ts into work items weighted by their expected cost
+# Every base event costs one unit plus one unit per potential responder, so a user's cost is their event count
+# times (1 + their nnz over all response matrices). Users costing more than an even share of n_bins bins are split
+# over their time bins into several items.
+def _build_work_items(ts, nonzero_rows, responses, n_bins):
+    responders = np.zeros(ts.shape[0], dtype=np.int64)
+    for response_matrix in responses.values():
+        responders += response_matrix.getnnz(axis=1)
+
+    event_counts = np.asarray(ts.sum(axis=1)).ravel()[nonzero_rows].astype(np.int64)
+    costs = event_counts * (1 + responders[nonzero_rows])
+    max_cost = max(costs.sum() / n_bins, 1)
+
+    items = [np.column_stack((nonzero_rows, np.zeros_like(nonzero_rows), np.full_like(nonzero_rows, ts.shape[1])))]
+    item_costs = [costs]
+    heavy = costs > max_cost
+    for root_user_id in nonzero_rows[heavy]:
+        row = ts[root_user_id]
+        columns = row.indices[row.data > 0]
+        entry_costs = row.data[row.data > 0] * (1 + responders[root_user_id])
+        # Cut the row where the cumulative cost passes a multiple of max_cost
+        piece = ((np.cumsum(entry_costs) - entry_costs) // max_cost).astype(np.int64)
+        starts = np.flatnonzero(np.diff(piece, prepend=-1))
+        bounds = np.append(columns[starts], ts.shape[1])
+        bounds[0] = 0
+        items.append(np.column_stack((np.full(len(starts), root_user_id), bounds[:-1], bounds[1:])))
+        item_costs.append(np.add.reduceat(entry_costs, starts))
+
+    items[0], item_costs[0] = items[0][~heavy], item_costs[0][~heavy]
+    return np.concatenate(items), np.concatenate(item_costs)
+
+
+# Worker function that each MapReduce worker will run
+# The data kwargs hold one entry per platform
+def _worker_generate_base_event(partition, ts, node_map, start_date, responses, generate_replies, streams):
+    platform, items = partition
+    ts, node_map, responses, streams = ts[platform], node_map[platform], responses[platform], streams[platform]
+
+    res = EventBuffer(id_generator=streams.base_ids)
+    root_event_ids = []
+    root_user_ids = []
+    root_event_ind = []
+    root_times = []
+    for root_user_id, first_bin, end_bin in items:
         ts_row = ts.getrow(root_user_id)
         __, events = ts_row.nonzero()
 
         # For each user, get event counts and the time index in which those events occurred
-        event_counts = [ts_row.getcol(event).toarray()[0][0] for event in events]
-        for i in range(len(event_counts)):
-            for j in range(event_counts[i]):
-                # Generate the base event
-                current_day_time = int(start_date + events[i] * 86400)
-                root_event_id = generate_random_node_id()
-                res.append({'nodeID': root_event_id, 'nodeUserID': node_map[root_user_id], 'parentID': root_event_id,
-                            'rootID': root_event_id, 'actionType': 'tweet', 'nodeTime': current_day_time,
-                            'platform': platform})
-                # Generate responses to the base event
-
-                if generate_replies:
-                    generated_responses = _generate_responses(root_event_id, root_user_id, current_day_time, responses,
-                                                              node_map, platform)
-
-                    # if len(generated_responses) == 0:
-                    #     msg = 'Root user ID ' + str(root_user_id) + ' generated no responses.'
-                    #     logger.warning(msg)
-
-                    res = res + generated_responses
-    return res
-
-
-def _generate_responses(root_event_id, root_user_id, current_day_time, responses, node_map, platform):
-    res = []
-
-    # For each event type generate responses using associated probabilities
-    for response_type in responses:
-        # Get the user response probabilities for the given event type and root user id
-        response_row = responses[response_type].getrow(root_user_id)
-
-        # If the probability is below some threshold, zero it out
-        # Have the users associated with the nonzero indices generate an event
-        response_row[response_row < random.random()] = 0
-        __, acting_indices = response_row.nonzero()
-
-        # Generate random timestamps and find the associated user id for each new event
-        time_stamps = [generate_random_time(current_day_time) for x in acting_indices]
-        node_user_ids = [node_map[x] for x in acting_indices]
-
-        res = res + [{'nodeID': generate_random_node_id(), 'nodeUserID': node_user_id, 'parentID': root_event_id,
-                      'rootID': root_event_id, 'actionType': response_type, 'nodeTime': node_time,
-                      'platform': platform} for
-                     node_user_id, node_time in zip(node_user_ids, time_stamps)]
-    return res
-
+        event_counts = ts_row.toarray()[0][events]
+        # Events before first_bin belong to another work item of the same user
+        in_item = (events >= first_bin) & (events < end_bin)
+        first_event = event_counts[events < first_bin].sum()
+        events, event_counts = events[in_item], event_counts[in_item]
+
+        # Generate the base events of the user
+        user_event_ind = first_event + np.arange(event_counts.sum())
+        user_event_ids = streams.base_keys(root_user_id, user_event_ind)
+        user_times = np.repeat([int(start_date + event * 86400) for event in events], event_counts)
+        res.append(user_event_ids, np.full(len(user_event_ids), root_user_id), user_times, 'tweet', platform,
+                   node_map)
+        root_event_ids.append(user_event_ids)
+        root_user_ids.append(np.full(len(user_event_ids), root_user_id))
+        root_event_ind.append(user_event_ind)
+        root_times.append(user_times)
+
+    # Generate responses to every base event of the partition at once
+    if generate_replies and len(res):
+        generate_responses(res, streams, np.concatenate(root_event_ids), np.concatenate(root_user_ids),
+                           np.concatenate(root_event_ind), np.concatenate(root_times), responses, node_map, platform)
+    # Partitions are sorted by time so that spilled partitions can be merged in time order
+    return res.sort_by_time()
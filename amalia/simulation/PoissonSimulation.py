@@ -1,22 +1,19 @@
 import logging
 
-from tools.EventGeneration import convert_date, generate_random_time, generate_random_node_id
+from tools.EventGeneration import convert_date, NodeIdGenerator, EventStreams, generate_responses, stream_events
 
 logger = logging.getLogger(__name__.split('.')[-1])
 
 from features.ResponseTypeFeature import ResponseTypeFeature
 from features.ReplayTimeSeriesFeature import ReplayTimeSeriesFeature
 import tools.Cache as Cache
+from tools.Graph import get_graph
+from tools.EventBuffer import EventBuffer
+from tools.MapReduce import map_platforms
 
-import random
+import numpy as np
 import pandas as pd
 
-import warnings
-from scipy.sparse import SparseEfficiencyWarning
-warnings.simplefilter('ignore', SparseEfficiencyWarning)
-
-random.seed(1234)
-
 class PoissonSimulation:
     '''
 
@@ -40,91 +37,88 @@ class PoissonSimulation:
             self.generate_replies = cfg.get("poisson_simulation.generate_replies", True)
         else:
             self.generate_replies = generate_replies
+        self.seed = cfg.get("poisson_simulation.seed", 1234)
+        self.platform_workers = cfg.get("simulation.platform_workers", 1)
 
         self.cfg = cfg
 
     @Cache.amalia_cache
     def compute(self, dfs, train_dfs=None):
-        # Retrieve replay time-series feature and response type feature
-        ts = ReplayTimeSeriesFeature(self.cfg).compute(dfs)
-        responses = ResponseTypeFeature(self.cfg).compute(dfs)
-
-        res = []
-
-        platforms = dfs.get_platforms()
-
         logger.warning('Very slow for dense data generation. Use ParallelPoissonSimulation to reduce runtime.')
-        for platform in platforms:
-            ts = ts[platform]
-            responses = responses[platform]
-            node_map = dfs.get_node_map(platform)
-
-            # For all users that have a nonzero row in their ts, generate events
-            logger.info('Generating new events.')
-            nonzero_rows, __ = ts.nonzero()
-
-            res = res + _generate_base_event(ts, node_map, nonzero_rows, self.start_date, responses, self.generate_replies, platform)
-
-        # Return a pandas DataFrame sorted by time  
-        # Feed into the output module for actual result generation  
-        res = pd.DataFrame(res)
+        # Platforms are independent, and run concurrently with simulation.platform_workers > 1
+        res = EventBuffer(id_generator=NodeIdGenerator(self.seed))
+        for platform_res in map_platforms(self.simulate_platform, dfs, self.platform_workers):
+            res.extend(platform_res)
 
+        # Return the events sorted by time
+        # Feed into the output module for actual result generation
         if len(res) == 0:
             logger.error('PoissonSimulation produced no events. Terminating.')
             raise ValueError('PoissonSimulation produced no events.')
 
-        return res.sort_values(by=['nodeTime']).reset_index(drop=True)
+        return res.sort_by_time()
+
+    def simulate_platform(self, dfs, platform_index, platform):
+        '''
 
-def _generate_base_event(ts, node_map, nonzero_rows, start_date, responses, generate_replies, platform):
-    res = []
+        Generate the events of one platform, given a DataFrame holding only that platform.
+
+        '''
+
+        # Retrieve replay time-series feature and response type feature
+        graph = get_graph(self.cfg, dfs)
+        graph.run([ReplayTimeSeriesFeature, ResponseTypeFeature])
+        ts = graph.get(ReplayTimeSeriesFeature)[platform]
+        responses = graph.get(ResponseTypeFeature)[platform]
+        node_map = dfs.get_node_map(platform)
+        # Draws are keyed by event, so the result matches ParallelPoissonSimulation for the same seed
+        streams = EventStreams(ts, responses, self.seed, platform_index)
+
+        # For all users that have a nonzero row in their ts, generate events
+        logger.info(f'Generating new events for {platform}.')
+        # Each user is visited once, however many time bins they are active in
+        nonzero_rows = np.unique(ts.nonzero()[0])
+
+        res = EventBuffer(id_generator=NodeIdGenerator(self.seed))
+        return _generate_base_event(res, streams, ts, node_map, nonzero_rows, self.start_date, responses,
+                                    self.generate_replies, platform)
+
+    def stream(self, dfs, train_dfs=None):
+        '''
+
+        Generate the events of compute() one time bin at a time, as a generator of
+        EventBuffers in time order. Peak memory depends on the busiest time bin
+        rather than on the whole replay.
+
+        '''
+
+        graph = get_graph(self.cfg, dfs)
+        graph.run([ReplayTimeSeriesFeature, ResponseTypeFeature])
+        ts = graph.get(ReplayTimeSeriesFeature)
+        responses = graph.get(ResponseTypeFeature)
+
+        platforms = [(platform, ts[platform], responses[platform], dfs.get_node_map(platform),
+                      EventStreams(ts[platform], responses[platform], self.seed, platform_index), 'tweet')
+                     for platform_index, platform in enumerate(dfs.get_platforms())]
+        return stream_events(platforms, self.start_date, 86400, NodeIdGenerator(self.seed), self.generate_replies)
+
+def _generate_base_event(buffer, streams, ts, node_map, nonzero_rows, start_date, responses, generate_replies, platform):
     for root_user_id in nonzero_rows:
         ts_row = ts.getrow(root_user_id)
         __, events = ts_row.nonzero()
 
         # For each user, get event counts and the time index in which those events occurred
         event_counts = [ts_row.getcol(event).toarray()[0][0] for event in events]
-        for i in range(len(event_counts)):
-            for j in range(event_counts[i]):
-                # Generate the base event
-                current_day_time = int(start_date + events[i] * 86400)
-                root_event_id = generate_random_node_id()
-                res.append({'nodeID': root_event_id, 'nodeUserID': node_map[root_user_id], 'parentID': root_event_id,
-                            'rootID': root_event_id, 'actionType': 'tweet', 'nodeTime': current_day_time,
-                            'platform': platform})
-                # Generate responses to the base event
-
-                if generate_replies:
-                    generated_responses = _generate_responses(root_event_id, root_user_id, current_day_time, responses,
-                                                              node_map, platform)
-
-                    # if len(generated_responses) == 0:
-                    #     msg = 'Root user ID ' + str(root_user_id) + ' generated no responses.'
-                    #     logger.warning(msg)
-
-                    res = res + generated_responses
-    return res
-
-
-def _generate_responses(root_event_id, root_user_id, current_day_time, responses, node_map, platform):
-    res = []
-
-    # For each event type generate responses using associated probabilities
-    for response_type in responses:
-        # Get the user response probabilities for the given event type and root user id
-        response_row = responses[response_type].getrow(root_user_id)
-
-        # If the probability is below some threshold, zero it out
-        # Have the users associated with the nonzero indices generate an event
-        response_row[response_row < random.random()] = 0
-        __, acting_indices = response_row.nonzero()
-
-        # Generate random timestamps and find the associated user id for each new event
-        time_stamps = [generate_random_time(current_day_time) for x in acting_indices]
-        node_user_ids = [node_map[x] for x in acting_indices]
-
-        res = res + [{'nodeID': generate_random_node_id(), 'nodeUserID': node_user_id, 'parentID': root_event_id,
-                      'rootID': root_event_id, 'actionType': response_type, 'nodeTime': node_time,
-                      'platform': platform} for
-                     node_user_id, node_time in zip(node_user_ids, time_stamps)]
-    return res
 
+        # Generate the base events of the user
+        root_event_ind = np.arange(sum(event_counts))
+        root_event_ids = streams.base_keys(root_user_id, root_event_ind)
+        root_times = np.repeat([int(start_date + event * 86400) for event in events], event_counts)
+        buffer.append(root_event_ids, np.full(len(root_event_ids), root_user_id), root_times, 'tweet', platform,
+                      node_map)
+
+        # Generate responses to all base events of the user at once
+        if generate_replies and len(root_event_ids):
+            generate_responses(buffer, streams, root_event_ids, np.full(len(root_event_ids), root_user_id),
+                               root_event_ind, root_times, responses, node_map, platform)
+    return buffer
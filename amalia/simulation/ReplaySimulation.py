@@ -9,6 +9,8 @@ import pandas as pd
 import numpy as np
 
 from features.ReplayTimeSeriesFeature import ReplayTimeSeriesFeature
+from tools.Graph import get_graph
+from dataframe.DataFrame import ID_COLUMNS
 
 
 class ReplaySimulation:
@@ -27,7 +29,10 @@ class ReplaySimulation:
         self.cfg = cfg
 
     def compute(self, dfs, train_dfs=None):
-        ts = ReplayTimeSeriesFeature(self.cfg).compute(dfs)
+        ts = get_graph(self.cfg, dfs).get(ReplayTimeSeriesFeature)
         df = pd.concat(dfs.get_df(platform) for platform in dfs.get_platforms())
+        df = df.drop(columns='userIdx')
+        for name in ID_COLUMNS:
+            df[name] = dfs.id_table.categorical(df[name])
         
         return df
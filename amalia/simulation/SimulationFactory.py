@@ -23,15 +23,24 @@ class SimulationFactory:
     def run_simulation(self, sim_key, data_loader: DataFrame):
         return self.simulation_map[sim_key].compute(data_loader)
 
+    def stream_simulation(self, sim_key, data_loader: DataFrame):
+        simulation = self.simulation_map[sim_key]
+        if not hasattr(simulation, 'stream'):
+            logger.error(f'{sim_key} does not support streaming output.')
+            raise ValueError(f'{sim_key} does not support streaming output.')
+        return simulation.stream(data_loader)
+
 def get_simulation_map():
     from simulation.ReplaySimulation import ReplaySimulation
     from simulation.ParallelPoissonSimulation import ParallelPoissonSimulation
     from simulation.PoissonSimulation import PoissonSimulation
+    from simulation.VectorizedPoissonSimulation import VectorizedPoissonSimulation
 
     return {
         'ReplaySimulation': ReplaySimulation,
         'PoissonSimulation': PoissonSimulation,
-        'ParallelPoissonSimulation': ParallelPoissonSimulation
+        'ParallelPoissonSimulation': ParallelPoissonSimulation,
+        'VectorizedPoissonSimulation': VectorizedPoissonSimulation
     }
 
 def initalize_simulations(cfg):
@@ -0,0 +1,147 @@
+import logging
+
+from tools.EventGeneration import convert_date, NodeIdGenerator, EventStreams, generate_responses, expand_event_counts, \
+    stream_events
+
+logger = logging.getLogger(__name__.split('.')[-1])
+
+from features.ResponseTypeFeature import ResponseTypeFeature
+from features.ReplayTimeSeriesFeature import ReplayTimeSeriesFeature
+import tools.Cache as Cache
+from tools.Graph import get_graph
+from tools.EventBuffer import EventBuffer
+from tools.MapReduce import map_platforms
+
+import numpy as np
+import pandas as pd
+
+
+class VectorizedPoissonSimulation:
+    '''
+
+    Vectorized variant of the PoissonSimulation. Instead of walking the
+    replayed time series row by row, every base event of a platform is
+    expanded directly from the CSR structure of the replay, and events are
+    collected column-wise rather than as one dictionary per event.
+
+    Parameters
+    ----------
+
+    start_date : str or int
+        Time the replayed segment starts at. Base events are placed at the
+        start of their time bin.
+
+    time_delta : int
+        The time range (in seconds) of one time bin of the replay.
+
+    generate_replies : bool (default : True)
+        Generate replies to the base events using the response probabilities
+        of the ResponseTypeFeature.
+
+    seed : int (default : 1234)
+        Seed of the run. Random draws are keyed by event through EventStreams.
+
+    Output
+    ------
+
+    An EventBuffer of events with the schema
+    nodeID,nodeUserID,parentID,rootID,actionType,nodeTime,platform,
+    sorted by nodeTime.
+
+    Notes
+    -----
+
+    Unlike the PoissonSimulation, which places base events 86400 seconds
+    apart and labels them 'tweet', this simulation bins base events by
+    limits.time_delta and labels them with the platform's action type from
+    time_series_archetype.base_actions. Both engines agree for the default
+    configuration (time_delta of 1d, Twitter base action 'tweet').
+
+    '''
+
+    def __init__(self, cfg, generate_replies=None, **kwargs):
+        self.start_date = cfg.get("limits.start_date", type=convert_date)
+        self.time_delta = cfg.get("limits.time_delta", type=pd.Timedelta).total_seconds()
+        self.base_actions = cfg.get("time_series_archetype.base_actions")
+        self.seed = cfg.get("vectorized_poisson_simulation.seed", 1234)
+        self.platform_workers = cfg.get("simulation.platform_workers", 1)
+
+        if generate_replies is None:
+            self.generate_replies = cfg.get("vectorized_poisson_simulation.generate_replies", True)
+        else:
+            self.generate_replies = generate_replies
+
+        self.cfg = cfg
+
+    @Cache.amalia_cache
+    def compute(self, dfs, train_dfs=None):
+        # Platforms are independent, and run concurrently with simulation.platform_workers > 1
+        res = EventBuffer(id_generator=NodeIdGenerator(self.seed))
+        for platform_res in map_platforms(self.simulate_platform, dfs, self.platform_workers):
+            res.extend(platform_res)
+
+        # Return the events sorted by time
+        # Feed into the output module for actual result generation
+        if len(res) == 0:
+            logger.error('VectorizedPoissonSimulation produced no events. Terminating.')
+            raise ValueError('VectorizedPoissonSimulation produced no events.')
+
+        return res.sort_by_time()
+
+    def simulate_platform(self, dfs, platform_index, platform):
+        '''
+
+        Generate the events of one platform, given a DataFrame holding only that platform.
+
+        '''
+
+        # Retrieve replay time-series feature and response type feature
+        graph = get_graph(self.cfg, dfs)
+        graph.run([ReplayTimeSeriesFeature, ResponseTypeFeature])
+        ts = graph.get(ReplayTimeSeriesFeature)[platform]
+        responses = graph.get(ResponseTypeFeature)[platform]
+        node_map = dfs.get_node_map(platform)
+        streams = EventStreams(ts, responses, self.seed, platform_index)
+
+        logger.info(f'Generating new events for {platform}.')
+        res = EventBuffer(id_generator=NodeIdGenerator(self.seed))
+        node_ids, user_ind, event_ind, node_times = _generate_base_events(res, streams, ts, node_map, self.start_date,
+                                                                          self.time_delta, self.base_actions[platform],
+                                                                          platform)
+
+        if self.generate_replies:
+            # Sample the responses to every base event of the platform at once
+            generate_responses(res, streams, node_ids, user_ind, event_ind, node_times, responses, node_map, platform)
+        return res
+
+    def stream(self, dfs, train_dfs=None):
+        '''
+
+        Generate the events of compute() one time bin at a time, as a generator of
+        EventBuffers in time order. Peak memory depends on the busiest time bin
+        rather than on the whole replay.
+
+        '''
+
+        graph = get_graph(self.cfg, dfs)
+        graph.run([ReplayTimeSeriesFeature, ResponseTypeFeature])
+        ts = graph.get(ReplayTimeSeriesFeature)
+        responses = graph.get(ResponseTypeFeature)
+
+        platforms = [(platform, ts[platform], responses[platform], dfs.get_node_map(platform),
+                      EventStreams(ts[platform], responses[platform], self.seed, platform_index), self.base_actions[platform])
+                     for platform_index, platform in enumerate(dfs.get_platforms())]
+        return stream_events(platforms, self.start_date, self.time_delta, NodeIdGenerator(self.seed), self.generate_replies)
+
+
+def _generate_base_events(buffer, streams, ts, node_map, start_date, time_delta, base_action, platform):
+    # One (user, time bin) pair per replayed event
+    user_ind, time_ind = expand_event_counts(ts)
+
+    # Events are expanded in user order, so the position of an event among its user's events follows from the offsets
+    event_ind = np.arange(len(user_ind)) - streams.event_offsets[user_ind]
+    node_ids = streams.base_keys(user_ind, event_ind)
+    node_times = np.rint(start_date + time_ind * time_delta)
+
+    buffer.append(node_ids, user_ind, node_times, base_action, platform, node_map)
+    return node_ids, user_ind, event_ind, node_times
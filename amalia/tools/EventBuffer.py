@@ -0,0 +1,338 @@
+import logging
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__.split('.')[-1])
+
+
+class EventBuffer:
+    '''
+
+    Columnar (struct-of-arrays) store for simulated events. Events are appended
+    in bulk as arrays, and only turned into a Pandas DataFrame when handed to
+    the OutputWriter.
+
+    Parameters
+    ----------
+
+    capacity : int (default : 1024)
+        Number of events to allocate room for up front. The buffer doubles its
+        capacity whenever an append would overflow it.
+
+    id_generator : NodeIdGenerator (default : None)
+        If given, nodeID, parentID and rootID are stored as int64 keys from
+        this generator and only encoded to strings by to_frame(). Otherwise
+        they are stored as given.
+
+    Notes
+    -----
+
+    Users are stored as int32 indices into the node map of their platform,
+    and actionType and platform are stored as categorical codes. The node maps
+    are registered on append, so the buffer can restore nodeUserIDs on its own.
+
+    '''
+
+    def __init__(self, capacity=1024, id_generator=None):
+        self._size = 0
+        self.id_generator = id_generator
+        id_dtype = object if id_generator is None else np.int64
+        self._columns = {
+            'nodeID': np.empty(capacity, dtype=id_dtype),
+            'parentID': np.empty(capacity, dtype=id_dtype),
+            'rootID': np.empty(capacity, dtype=id_dtype),
+            'userIdx': np.empty(capacity, dtype=np.int32),
+            'actionType': np.empty(capacity, dtype=np.uint8),
+            'nodeTime': np.empty(capacity, dtype=np.float64),
+            'platform': np.empty(capacity, dtype=np.uint8),
+        }
+        self.action_types = []
+        self.platforms = []
+        self.node_maps = {}
+
+    def __len__(self):
+        return self._size
+
+    def column(self, name):
+        '''
+
+        Return a view of the filled part of a column.
+
+        '''
+
+        return self._columns[name][:self._size]
+
+    def append(self, node_ids, user_ind, node_times, action_type, platform, node_map, parent_ids=None, root_ids=None):
+        '''
+
+        Append a batch of events of one platform.
+
+        Parameters
+        ----------
+
+        node_ids : 1D array
+            The nodeID of every event.
+
+        user_ind : 1D int array
+            The index of every event's user within node_map.
+
+        node_times : 1D array
+            The nodeTime of every event.
+
+        action_type : str or 1D array of str
+            The actionType of every event, or one actionType shared by the whole batch.
+
+        platform : str
+            The platform the events belong to.
+
+        node_map : list
+            The platform's node map.
+
+        parent_ids, root_ids : 1D array (default : None)
+            The parentID and rootID of every event. Default to node_ids, as for base events.
+
+        '''
+
+        n = len(node_ids)
+        if n == 0:
+            return
+        if parent_ids is None:
+            parent_ids = node_ids
+        if root_ids is None:
+            root_ids = parent_ids
+
+        if platform not in self.node_maps:
+            self.node_maps[platform] = np.asarray(node_map, dtype=object)
+
+        self._reserve(self._size + n)
+        end = self._size + n
+        self._columns['nodeID'][self._size:end] = node_ids
+        self._columns['parentID'][self._size:end] = parent_ids
+        self._columns['rootID'][self._size:end] = root_ids
+        self._columns['userIdx'][self._size:end] = user_ind
+        self._columns['nodeTime'][self._size:end] = node_times
+        self._columns['actionType'][self._size:end] = _encode(self.action_types, action_type)
+        self._columns['platform'][self._size:end] = _encode(self.platforms, platform)
+        self._size = end
+
+    def extend(self, other):
+        '''
+
+        Append all events of another EventBuffer.
+
+        '''
+
+        for p_code, platform in enumerate(other.platforms):
+            mask = other.column('platform') == p_code
+            if not mask.any():
+                continue
+            action_types = np.asarray(other.action_types, dtype=object)[other.column('actionType')[mask]]
+            self.append(other.column('nodeID')[mask], other.column('userIdx')[mask], other.column('nodeTime')[mask],
+                        action_types, platform, other.node_maps[platform], parent_ids=other.column('parentID')[mask],
+                        root_ids=other.column('rootID')[mask])
+        return self
+
+    def sort_by_time(self):
+        '''
+
+        In-place sort of all events by nodeTime. With an id_generator, ties are broken
+        by the int64 nodeID keys, which gives an order independent of how the events
+        were appended. Otherwise the sort is stable.
+
+        '''
+
+        if self.id_generator is not None:
+            order = np.lexsort((self.column('nodeID'), self.column('nodeTime')))
+        else:
+            order = np.argsort(self.column('nodeTime'), kind='stable')
+        for name, values in self._columns.items():
+            values[:self._size] = values[:self._size][order]
+        return self
+
+    def split(self, time):
+        '''
+
+        Split a buffer sorted by time into a buffer of the events before time and a buffer of the rest.
+
+        '''
+
+        index = int(np.searchsorted(self.column('nodeTime'), time, side='left'))
+        return self._slice(0, index), self._slice(index, self._size)
+
+    def to_frame(self):
+        '''
+
+        Return the events as a Pandas DataFrame with the schema
+        nodeID,nodeUserID,parentID,rootID,actionType,nodeTime,platform.
+
+        '''
+
+        platform_codes = self.column('platform')
+        user_ind = self.column('userIdx')
+        node_user_ids = np.empty(self._size, dtype=object)
+        for p_code, platform in enumerate(self.platforms):
+            mask = platform_codes == p_code
+            node_user_ids[mask] = self.node_maps[platform][user_ind[mask]]
+
+        ids = {name: self.column(name) for name in ['nodeID', 'parentID', 'rootID']}
+        if self.id_generator is not None:
+            ids = {name: self.id_generator.encode(keys) for name, keys in ids.items()}
+
+        return pd.DataFrame({'nodeID': ids['nodeID'], 'nodeUserID': node_user_ids,
+                             'parentID': ids['parentID'], 'rootID': ids['rootID'],
+                             'actionType': np.asarray(self.action_types, dtype=object)[self.column('actionType')],
+                             'nodeTime': self.column('nodeTime'),
+                             'platform': np.asarray(self.platforms, dtype=object)[platform_codes]})
+
+    def save(self, directory):
+        '''
+
+        Write the buffer to directory as one .npy file per column, so it can be
+        memory-mapped by load(). Node maps are not written, as every spilled
+        partition of a platform shares them.
+
+        '''
+
+        os.makedirs(directory, exist_ok=True)
+        for name in self._columns:
+            np.save(os.path.join(directory, name + '.npy'), self.column(name), allow_pickle=True)
+        with open(os.path.join(directory, 'meta.pkl'), 'wb') as f:
+            pickle.dump({'action_types': self.action_types, 'platforms': self.platforms,
+                         'id_generator': self.id_generator}, f)
+
+    @classmethod
+    def load(cls, directory, node_maps, start=0, stop=None):
+        '''
+
+        Read the events [start, stop) of a buffer written by save(). Columns are
+        memory-mapped, so only the requested rows are read from disk.
+
+        '''
+
+        with open(os.path.join(directory, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+        buffer = cls(capacity=0, id_generator=meta['id_generator'])
+        for name in buffer._columns:
+            column = load_column(directory, name)
+            buffer._columns[name] = np.array(column[start:stop])
+        buffer._size = len(buffer._columns['nodeTime'])
+        buffer.action_types = meta['action_types']
+        buffer.platforms = meta['platforms']
+        buffer.node_maps = {platform: np.asarray(node_maps[platform], dtype=object) for platform in buffer.platforms}
+        return buffer
+
+    def _slice(self, start, stop):
+        buffer = EventBuffer(capacity=0, id_generator=self.id_generator)
+        buffer._columns = {name: values[start:stop].copy() for name, values in self._columns.items()}
+        buffer._size = stop - start
+        buffer.action_types = list(self.action_types)
+        buffer.platforms = list(self.platforms)
+        buffer.node_maps = dict(self.node_maps)
+        return buffer
+
+    def _reserve(self, size):
+        capacity = len(self._columns['nodeTime'])
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        for name, values in self._columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self._size] = values[:self._size]
+            self._columns[name] = grown
+
+
+def load_column(directory, name):
+    '''
+
+    Memory-map one column of a buffer written by EventBuffer.save().
+
+    '''
+
+    fpath = os.path.join(directory, name + '.npy')
+    try:
+        return np.load(fpath, mmap_mode='r')
+    except ValueError:
+        # Object columns (string ids) cannot be memory-mapped
+        return np.load(fpath, allow_pickle=True)
+
+
+class SpilledEvents:
+    '''
+
+    Handles to EventBuffers that map tasks spilled to disk, each sorted by time.
+    The partitions are merged into time-ordered chunks on demand, so the events
+    never need to be held in memory all at once.
+
+    Parameters
+    ----------
+
+    handles : list of SpillHandle
+        Handles returned by a MapReduce run with the spill reduce mode.
+
+    node_maps : dict
+        Node map of every platform in the spilled buffers.
+
+    '''
+
+    def __init__(self, handles, node_maps):
+        self.handles = list(handles)
+        self.node_maps = node_maps
+
+    def __len__(self):
+        return sum(len(load_column(handle.path, 'nodeTime')) for handle in self.handles)
+
+    def iter_chunks(self, chunk_size=1000000):
+        '''
+
+        Yield EventBuffers of about chunk_size events, in time order across all partitions.
+
+        '''
+
+        times = [load_column(handle.path, 'nodeTime') for handle in self.handles]
+        total = sum(len(t) for t in times)
+        if total == 0:
+            return
+
+        # Pick cut times from a sample of every partition so that chunks hold about chunk_size events
+        step = max(1, chunk_size // 64)
+        sample = np.sort(np.concatenate([t[::step] for t in times]))
+        cuts = np.unique(sample[chunk_size // step::chunk_size // step])
+        bounds = np.concatenate((cuts, [np.inf]))
+
+        lower = [0] * len(times)
+        for bound in bounds:
+            chunk = None
+            for i, (handle, t) in enumerate(zip(self.handles, times)):
+                upper = len(t) if bound == np.inf else int(np.searchsorted(t, bound, side='left'))
+                if upper > lower[i]:
+                    part = EventBuffer.load(handle.path, self.node_maps, lower[i], upper)
+                    chunk = part if chunk is None else chunk.extend(part)
+                lower[i] = upper
+            if chunk is not None:
+                yield chunk.sort_by_time()
+
+    def to_frame(self):
+        '''
+
+        Return all events as one Pandas DataFrame sorted by time.
+
+        '''
+
+        return pd.concat([chunk.to_frame() for chunk in self.iter_chunks()], ignore_index=True)
+
+
+# Translate a label or array of labels to codes, registering unseen labels
+def _encode(categories, labels):
+    if isinstance(labels, str):
+        if labels not in categories:
+            categories.append(labels)
+        return categories.index(labels)
+
+    uniques, inverse = np.unique(np.asarray(labels, dtype=object), return_inverse=True)
+    for label in uniques:
+        if label not in categories:
+            categories.append(label)
+    return np.array([categories.index(label) for label in uniques], dtype=np.uint8)[inverse]
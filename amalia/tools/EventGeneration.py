@@ -4,8 +4,14 @@ import string
 import time
 from datetime import datetime
 
+import numpy as np
+
+from tools.EventBuffer import EventBuffer
+
 logger = logging.getLogger(__name__.split('.')[-1])
 
+_NODE_ID_ALPHABET = np.frombuffer((string.ascii_letters + string.digits).encode(), dtype=np.uint8)
+
 
 def convert_date(date):
     if isinstance(date, str):
@@ -22,4 +28,474 @@ def generate_random_time(current_day_time):
 
 
 def generate_random_node_id(k=22):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=k))
\ No newline at end of file
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=k))
+
+
+def generate_random_node_ids(n, k=22, rng=None):
+    '''
+
+    Batched counterpart of generate_random_node_id(). Returns an object array of n random
+    alphanumeric ids of length k drawn from rng.
+
+    '''
+
+    if rng is None:
+        rng = np.random.default_rng()
+    codes = _NODE_ID_ALPHABET[rng.integers(0, len(_NODE_ID_ALPHABET), size=(n, k))]
+    return codes.view(f'S{k}').ravel().astype(f'U{k}').astype(object)
+
+
+class NodeIdGenerator:
+    '''
+
+    Batched node id generator that never repeats an id within a run.
+
+    Ids are built from a counter: every counter value is scrambled with a
+    bijective 64-bit mix keyed by the seed, so distinct counters always give
+    distinct ids. Ids can be kept as int64 keys and encoded to base62
+    strings only when they are written out.
+
+    Parameters
+    ----------
+
+    seed : int (default : None)
+        Seed of the run. Generators sharing a seed encode ids identically.
+
+    stream : int (default : 0)
+        Identifier of an independent counter, e.g. the partition index of a
+        parallel simulation. Generators with the same seed and different
+        streams never produce the same id.
+
+    Notes
+    -----
+
+    A string id is a 11 character prefix derived from the seed followed by
+    the 11 character base62 encoding of the 64-bit key, matching the 22
+    characters of generate_random_node_id().
+
+    '''
+
+    STREAM_BITS = 24
+    COUNTER_BITS = 40
+
+    def __init__(self, seed=None, stream=0):
+        if not 0 <= stream < 2 ** self.STREAM_BITS:
+            raise ValueError(f'NodeIdGenerator stream must be in [0, {2 ** self.STREAM_BITS}).')
+        key, prefix = np.random.SeedSequence(seed).generate_state(2, dtype=np.uint64)
+        self.key = key
+        self.prefix = _base62_digits(np.array([prefix], dtype=np.uint64))[0]
+        self.stream = stream
+        self.counter = 0
+
+    def generate(self, n, as_int=False):
+        '''
+
+        Return n new ids, as an object array of strings or, if as_int, as int64 keys.
+
+        '''
+
+        keys = self.keys(np.arange(self.counter, self.counter + n, dtype=np.uint64))
+        self.counter += n
+        return keys if as_int else self.encode(keys)
+
+    def keys(self, counters):
+        '''
+
+        Return the int64 keys of the given counter values of this stream, without advancing the counter.
+
+        '''
+
+        counters = np.asarray(counters, dtype=np.uint64)
+        if len(counters) and counters.max() >= 2 ** self.COUNTER_BITS:
+            raise ValueError('NodeIdGenerator stream exhausted.')
+        return _mix64((counters | np.uint64(self.stream << self.COUNTER_BITS)) ^ self.key).view(np.int64)
+
+    def encode(self, keys):
+        '''
+
+        Encode int64 keys from generate(as_int=True) into their string ids.
+
+        '''
+
+        keys = np.asarray(keys, dtype=np.int64).view(np.uint64)
+        chars = np.empty((len(keys), 2 * len(self.prefix)), dtype=np.uint8)
+        chars[:, :len(self.prefix)] = self.prefix
+        chars[:, len(self.prefix):] = _base62_digits(keys)
+        return chars.view(f'S{chars.shape[1]}').ravel().astype(f'U{chars.shape[1]}').astype(object)
+
+
+# splitmix64 finalizer, a bijection on 64-bit integers
+def _mix64(x):
+    x = x.copy()
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xbf58476d1ce4e5b9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94d049bb133111eb)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def keyed_uniform(keys, draw=0):
+    '''
+
+    Counter-based uniform draws in [0, 1). The value for a key depends only on the key and the
+    draw index, so the same event gets the same draw whichever process or partition generates it.
+
+    '''
+
+    keys = np.asarray(keys, dtype=np.int64).view(np.uint64)
+    offset = np.uint64(((draw + 1) * 0x9e3779b97f4a7c15) % 2 ** 64)
+    return (_mix64(keys + offset) >> np.uint64(11)) * 2.0 ** -53
+
+
+class EventStreams:
+    '''
+
+    Partition-invariant randomness for the events of one platform.
+
+    Every base event and every potential response is given a global
+    position derived from the replayed time series and the response
+    matrices alone. Node ids are drawn from these positions, and all other
+    draws are keyed by the node ids, so a simulation produces identical
+    events for a given seed regardless of how users are partitioned or in
+    which order they are processed.
+
+    Parameters
+    ----------
+
+    ts : scipy.sparse matrix
+        Replayed time series of the platform, as output by the ReplayTimeSeriesFeature.
+
+    responses : dict
+        Response probability matrix for each response type, as output by the
+        ResponseTypeFeature for the platform.
+
+    seed : int (default : None)
+        Seed of the run.
+
+    platform_index : int (default : 0)
+        Position of the platform, which selects the id streams of the platform.
+
+    Notes
+    -----
+
+    The k-th base event of user u has position event_offsets[u] + k, in the
+    order of time bins. Every base event reserves one reply slot per nonzero
+    response probability of its user, across all response types, so a
+    response is identified by its root event, response type and candidate.
+
+    '''
+
+    def __init__(self, ts, responses, seed=None, platform_index=0):
+        self.base_ids = NodeIdGenerator(seed, stream=2 * platform_index)
+        self.reply_ids = NodeIdGenerator(seed, stream=2 * platform_index + 1)
+        self.response_types = list(responses)
+
+        event_counts = np.asarray(ts.sum(axis=1)).ravel().astype(np.int64)
+        self.event_offsets = np.cumsum(event_counts) - event_counts
+
+        candidates = np.zeros((len(self.response_types), ts.shape[0]), dtype=np.int64)
+        for type_index, response_type in enumerate(self.response_types):
+            candidates[type_index] = responses[response_type].tocsr().getnnz(axis=1)
+        self.type_offsets = np.cumsum(candidates, axis=0) - candidates
+        self.candidates = candidates.sum(axis=0)
+        slots = event_counts * self.candidates
+        self.slot_offsets = np.cumsum(slots) - slots
+
+    def base_keys(self, user_ind, event_ind):
+        '''
+
+        Return the int64 keys of base events, given their user and their position among the user's events.
+
+        '''
+
+        return self.base_ids.keys(self.event_offsets[user_ind] + event_ind)
+
+    def reply_keys(self, root_user_ind, root_event_ind, type_index, positions):
+        '''
+
+        Return the int64 keys of responses, given the user and position of their root event, the
+        index of their response type and their position within the root user's response row.
+
+        '''
+
+        root_user_ind = np.asarray(root_user_ind, dtype=np.int64)
+        counters = (self.slot_offsets[root_user_ind] + root_event_ind * self.candidates[root_user_ind]
+                    + self.type_offsets[type_index, root_user_ind] + positions)
+        return self.reply_ids.keys(counters)
+
+
+# Fixed width (11 character) base62 encoding of unsigned 64-bit integers, as an array of ASCII codes
+def _base62_digits(values, k=11):
+    values = values.copy()
+    digits = np.empty((len(values), k), dtype=np.uint8)
+    for i in range(k - 1, -1, -1):
+        quotient = values // np.uint64(62)
+        digits[:, i] = _NODE_ID_ALPHABET[(values - quotient * np.uint64(62)).astype(np.intp)]
+        values = quotient
+    return digits
+
+
+def expand_event_counts(counts):
+    '''
+
+    Expand a sparse matrix of binned event counts into one (row, col) pair per event.
+
+    Parameters
+    ----------
+
+    counts : scipy.sparse matrix
+        Matrix where the (i, j) entry is the number of events user i produced in time bin j,
+        such as the output of the ReplayTimeSeriesFeature.
+
+    Output
+    ------
+
+    Two integer arrays of equal length holding the row (user) index and the column (time bin)
+    index of every event. Events are ordered by row, then by column.
+
+    '''
+
+    counts = counts.tocsr()
+    counts.sort_indices()
+    row_ind = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    repeats = counts.data.astype(np.int64)
+    return np.repeat(row_ind, repeats), np.repeat(counts.indices, repeats)
+
+
+def generate_random_times(current_day_times, rng=None, keys=None):
+    '''
+
+    Vectorized counterpart of generate_random_time(). Draws one offset for every entry of current_day_times,
+    from rng, or from keyed_uniform() if the int64 keys of the events are given.
+
+    '''
+
+    current_day_times = np.asarray(current_day_times, dtype=float)
+    if keys is not None:
+        hours, minutes, seconds = (keyed_uniform(keys, draw) for draw in range(3))
+    else:
+        if rng is None:
+            rng = np.random.default_rng()
+        hours, minutes, seconds = rng.random((3, len(current_day_times)))
+    return current_day_times + (hours * 60 + minutes) * 60 + seconds
+
+
+def sample_responses(probabilities, root_rows, rng=None, chunk_size=2 ** 22, thresholds=None, return_positions=False):
+    '''
+
+    Sample the responses to a batch of root events in one vectorized pass.
+
+    Parameters
+    ----------
+
+    probabilities : scipy.sparse.csr_matrix
+        Response probabilities for one response type, where the (i, j) entry is the probability
+        that user j responds to an event of user i.
+
+    root_rows : 1D int array
+        The row (root user index) of every root event. Rows may repeat, e.g. all root events
+        of one user or of a whole partition.
+
+    rng : numpy.random.Generator (default : None)
+        Generator to draw from. A fresh, unseeded generator is used if not given.
+
+    chunk_size : int (default : 4194304)
+        Upper bound on the number of candidate responses materialized at once.
+
+    thresholds : 1D float array (default : None)
+        The threshold of every root event. Drawn from rng if not given.
+
+    return_positions : bool (default : False)
+        Also return the position of every response within its root row.
+
+    Output
+    ------
+
+    Two integer arrays of equal length: the position in root_rows of the event being responded to,
+    and the column (user index) of the responding user. With return_positions, a third array holds
+    the position of the responding user among the nonzero entries of the root row.
+
+    Notes
+    -----
+
+    As in the original per-event model, a single uniform threshold is drawn for each root event,
+    and every user whose response probability is at or above that threshold responds.
+
+    '''
+
+    probabilities = probabilities.tocsr()
+    root_rows = np.asarray(root_rows, dtype=np.int64)
+    indptr = probabilities.indptr
+    if thresholds is None:
+        if rng is None:
+            rng = np.random.default_rng()
+        thresholds = rng.random(len(root_rows))
+
+    starts = indptr[root_rows]
+    lengths = indptr[root_rows + 1] - starts
+    ends = np.cumsum(lengths)
+
+    root_res, user_res, position_res = [], [], []
+    # Split the root events so that at most chunk_size candidates are expanded at once
+    bounds = np.searchsorted(ends, np.arange(chunk_size, ends[-1] if len(ends) else 0, chunk_size), side='right')
+    for lo, hi in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(root_rows)]))):
+        if lo == hi:
+            continue
+        chunk_lengths = lengths[lo:hi]
+        root_ind = np.repeat(np.arange(lo, hi), chunk_lengths)
+        # Position of every candidate within data/indices of the CSR matrix
+        offsets = np.arange(len(root_ind)) + np.repeat(starts[lo:hi] - (np.cumsum(chunk_lengths) - chunk_lengths),
+                                                       chunk_lengths)
+        p = probabilities.data[offsets]
+        keep = (p > 0) & (p >= thresholds[root_ind])
+        root_res.append(root_ind[keep])
+        user_res.append(probabilities.indices[offsets[keep]])
+        position_res.append(offsets[keep] - starts[root_ind[keep]])
+
+    if not root_res:
+        res = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=probabilities.indices.dtype), np.zeros(0, dtype=np.int64))
+    else:
+        res = (np.concatenate(root_res), np.concatenate(user_res), np.concatenate(position_res))
+    return res if return_positions else res[:2]
+
+
+def generate_responses(buffer, streams, root_event_ids, root_user_ids, root_event_ind, root_times, responses, node_map,
+                       platform):
+    '''
+
+    Generate the responses to a batch of root events for every response type of a platform.
+
+    Parameters
+    ----------
+
+    buffer : EventBuffer
+        Buffer the generated response events are appended to. Its id_generator must share the seed of streams.
+
+    streams : EventStreams
+        The platform's event streams, which key the response thresholds, node ids and timestamps.
+
+    root_event_ids : 1D int64 array
+        The int64 key of every root event.
+
+    root_user_ids : 1D int array
+        The row (user index) of the user behind every root event.
+
+    root_event_ind : 1D int array
+        The position of every root event among the events of its user.
+
+    root_times : 1D array
+        The nodeTime of every root event.
+
+    responses : dict
+        Response probability matrix for each response type, as output by the ResponseTypeFeature
+        for one platform.
+
+    node_map : list
+        The platform's node map.
+
+    platform : str
+        The platform the events belong to.
+
+    Notes
+    -----
+
+    As every draw is keyed by the root event, the responses to an event do not depend on the
+    other events in the batch.
+
+    '''
+
+    root_event_ids = np.asarray(root_event_ids, dtype=np.int64)
+    root_user_ids = np.asarray(root_user_ids, dtype=np.int64)
+    root_event_ind = np.asarray(root_event_ind, dtype=np.int64)
+    root_times = np.asarray(root_times)
+
+    # For each event type generate responses using associated probabilities
+    for type_index, response_type in enumerate(streams.response_types):
+        root_ind, acting_indices, positions = sample_responses(responses[response_type], root_user_ids,
+                                                               thresholds=keyed_uniform(root_event_ids, type_index),
+                                                               return_positions=True)
+        node_ids = streams.reply_keys(root_user_ids[root_ind], root_event_ind[root_ind], type_index, positions)
+        buffer.append(node_ids, acting_indices, generate_random_times(root_times[root_ind], keys=node_ids),
+                      response_type, platform, node_map, parent_ids=root_event_ids[root_ind])
+    return buffer
+
+
+def stream_events(platforms, start_date, time_delta, id_generator, generate_replies=True):
+    '''
+
+    Generate the base events and responses of a replay one time bin at a time.
+
+    Parameters
+    ----------
+
+    platforms : list of tuple
+        One (platform, ts, responses, node_map, streams, base_action) tuple per platform, where ts is
+        the replayed time series, responses the response probability matrices and streams the
+        EventStreams of the platform.
+
+    start_date : int
+        Time the replayed segment starts at.
+
+    time_delta : int
+        The time range (in seconds) of one time bin of the replay.
+
+    id_generator : NodeIdGenerator
+        Generator sharing the seed of the streams, used to encode node ids.
+
+    generate_replies : bool (default : True)
+        Generate replies to the base events.
+
+    Output
+    ------
+
+    A generator of EventBuffers, each sorted by time, such that all events of a buffer precede the
+    events of the next one. Responses that fall after the start of the next time bin are carried
+    over until that bin has been generated, so only about one time bin is held in memory.
+
+    Notes
+    -----
+
+    As all draws are keyed by event, the events are the same as when the whole replay is generated at once.
+
+    '''
+
+    columns = {}
+    seen = {}
+    for platform, ts, __, __, __, __ in platforms:
+        columns[platform] = ts.tocsc(copy=True)
+        columns[platform].sum_duplicates()
+        seen[platform] = np.zeros(ts.shape[0], dtype=np.int64)
+
+    carry = EventBuffer(id_generator=id_generator)
+    n_bins = max((ts.shape[1] for __, ts, __, __, __, __ in platforms), default=0)
+    for time_bin in range(n_bins):
+        for platform, ts, responses, node_map, streams, base_action in platforms:
+            if time_bin >= ts.shape[1]:
+                continue
+            column = columns[platform]
+            lo, hi = column.indptr[time_bin], column.indptr[time_bin + 1]
+            counts = column.data[lo:hi].astype(np.int64)
+            users = column.indices[lo:hi][counts > 0]
+            counts = counts[counts > 0]
+            if not len(users):
+                continue
+
+            # Position of every event among all events of its user, continuing from the previous time bins
+            user_ind = np.repeat(users, counts)
+            event_ind = np.repeat(seen[platform][users] - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+            seen[platform][users] += counts
+
+            node_ids = streams.base_keys(user_ind, event_ind)
+            node_times = np.full(len(user_ind), np.rint(start_date + time_bin * time_delta))
+            carry.append(node_ids, user_ind, node_times, base_action, platform, node_map)
+            if generate_replies:
+                generate_responses(carry, streams, node_ids, user_ind, event_ind, node_times, responses, node_map,
+                                   platform)
+
+        # Events before the next time bin are final
+        chunk, carry = carry.sort_by_time().split(np.rint(start_date + (time_bin + 1) * time_delta))
+        if len(chunk):
+            yield chunk
+    if len(carry):
+        yield carry
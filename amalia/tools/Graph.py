@@ -0,0 +1,138 @@
+import logging
+
+logger = logging.getLogger(__name__.split('.')[-1])
+
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Graphs of every DataFrame, see get_graph()
+_graphs = weakref.WeakKeyDictionary()
+_graphs_lock = threading.Lock()
+
+
+class Graph:
+    '''
+
+    Computes archetypes and features at most once per DataFrame and keeps their results in memory.
+
+    Parameters
+    ----------
+
+    cfg : ConfigHandler
+        The config nodes are created with.
+
+    dfs : DataFrame
+        The data nodes are computed on.
+
+    n_workers : int (default : 1)
+        Number of threads nodes whose dependencies are computed run on concurrently.
+
+    Notes
+    -----
+
+    A node is an archetype or feature class, which is created with cfg and computed with
+    compute(dfs). Nodes declare the nodes their compute() uses in a dependencies class attribute
+    (nodes without one have none), and get them from the graph with get_graph(cfg, dfs).get(node), so they are computed once
+    however many nodes use them. The time every node took is kept in timings and logged. Results are
+    dropped when data is appended to the DataFrame, as they no longer cover all of it.
+
+    '''
+
+    def __init__(self, cfg, dfs, n_workers=1):
+        self.cfg = cfg
+        self.dfs = dfs
+        self.n_workers = n_workers
+        self.results = {}
+        self.timings = {}
+        self._lock = threading.RLock()
+        self._version = _version(dfs)
+
+    def get(self, node):
+        '''
+
+        Return the result of a node, computing it and its dependencies first if needed.
+
+        '''
+
+        # Nodes get their dependencies while run() holds the lock, and those are always computed by then
+        if node not in self.results or self._version != _version(self.dfs):
+            self.run([node])
+        return self.results[node]
+
+    def run(self, nodes):
+        '''
+
+        Compute the given nodes and their dependencies. Nodes run as soon as all their dependencies
+        are computed, up to n_workers at a time.
+
+        '''
+
+        with self._lock:
+            if self._version != _version(self.dfs):
+                self.results, self.timings, self._version = {}, {}, _version(self.dfs)
+            pending = [node for node in _closure(nodes) if node not in self.results]
+            if not pending:
+                return
+            with ThreadPoolExecutor(max(1, self.n_workers)) as pool:
+                running = {}
+                while pending or running:
+                    for node in [node for node in pending
+                                 if all(dependency in self.results for dependency in _dependencies(node))]:
+                        pending.remove(node)
+                        running[pool.submit(self._compute, node)] = node
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        del running[future]
+                        future.result()
+
+    def _compute(self, node):
+        start = time.perf_counter()
+        result = node(self.cfg).compute(self.dfs)
+        self.timings[node.__name__] = time.perf_counter() - start
+        logger.info(f'Computed {node.__name__} in {self.timings[node.__name__]:.2f}s')
+        self.results[node] = result
+
+
+def get_graph(cfg, dfs):
+    '''
+
+    Return the graph of a config and DataFrame, creating it on first use. Graphs live as long as
+    their DataFrame, and run nodes on graph.n_workers threads.
+
+    '''
+
+    with _graphs_lock:
+        graphs = _graphs.setdefault(dfs, [])
+        for graph in graphs:
+            if graph.cfg is cfg:
+                return graph
+        graph = Graph(cfg, dfs, n_workers=cfg.get('graph.n_workers', default=2))
+        graphs.append(graph)
+        return graph
+
+
+# Number of paths appended to the data, which changes whenever its datasets do
+def _version(dfs):
+    return sum(len(paths) for paths in getattr(dfs, 'appended', {}).values())
+
+
+def _dependencies(node):
+    return getattr(node, 'dependencies', [])
+
+
+# The nodes and all their dependencies, dependencies first
+def _closure(nodes):
+    order = []
+
+    def visit(node):
+        if node in order:
+            return
+        for dependency in _dependencies(node):
+            visit(dependency)
+        order.append(node)
+
+    for node in nodes:
+        visit(node)
+    return order
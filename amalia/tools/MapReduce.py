@@ -2,11 +2,23 @@
 
 import os
 import dask
+import pickle
+import uuid
+import functools
+import heapq
 import numpy as np
+import scipy.sparse as ss
 import dask.distributed
+import concurrent.futures
+from multiprocessing import shared_memory
 
 # MapReduce function
-def map_reduce(partition, map_function, reduce_function, scatter_data_kwargs={}, map_function_kwargs={}, reduce_function_kwargs={}):
+# reduce_mode selects how the mapped partitions are reduced:
+#   tree   - pairwise reduction tree, each level halving the number of partitions
+#   concat - a single reduce call over all mapped partitions, linear in the output size
+#   spill  - the mapped partitions are returned unreduced, as a list (e.g. of SpillHandles from map_and_spill)
+def map_reduce(partition, map_function, reduce_function, scatter_data_kwargs={}, map_function_kwargs={}, reduce_function_kwargs={},
+               reduce_mode='tree'):
     if scatter_data_kwargs:
         scatter_data_kwargs = scatter_kwargs(scatter_data_kwargs)    
     if map_function_kwargs:
@@ -16,8 +28,13 @@ def map_reduce(partition, map_function, reduce_function, scatter_data_kwargs={},
 
     partition = [map_function(indices, **scatter_data_kwargs, **map_function_kwargs) for indices in partition]
 
+    if reduce_mode == 'spill':
+        return dask.delayed(list)(partition)
+    if reduce_mode == 'concat' or len(partition) == 1:
+        return reduce_function(partition, **reduce_function_kwargs)
+
     partition_mapping = partition_nodes(len(partition), 2)
-    if len(np.array(partition_mapping).ravel()) % 2:
+    if len(partition) % 2:
         partition_mapping[-2:] = [np.concatenate((partition_mapping[-2], partition_mapping[-1]), axis=None)]
 
     partition = [reduce_function(partition[indices[0]:indices[-1]+1], **reduce_function_kwargs) for indices in partition_mapping]
@@ -44,9 +61,39 @@ def reduce_csr_matrix(reduce_matrices, *args, **kwargs):
 def reduce_list(lists_to_reduce, *args, **kwargs):
     reduced_list = []
     for l in lists_to_reduce:
-        reduced_list = reduced_list + l
+        reduced_list.extend(l)
     return reduced_list
 
+def reduce_event_buffers(buffers_to_reduce, *args, **kwargs):
+    reduced_buffer = buffers_to_reduce[0]
+    for buffer in buffers_to_reduce[1:]:
+        reduced_buffer.extend(buffer)
+    return reduced_buffer
+
+# Spill functions
+# A spilled result is written by its map task and only read back by the driver when it is needed
+class SpillHandle:
+    def __init__(self, path, cls=None):
+        self.path = path
+        self.cls = cls
+
+    def load(self, *args, **kwargs):
+        if self.cls is not None:
+            return self.cls.load(self.path, *args, **kwargs)
+        with open(self.path, 'rb') as f:
+            return pickle.load(f)
+
+def map_and_spill(map_function, spill_directory, indices, **kwargs):
+    result = map_function(indices, **kwargs)
+    path = os.path.join(spill_directory, uuid.uuid4().hex)
+    # Results that can save themselves (e.g. EventBuffer) are written in their own format, anything else is pickled
+    if hasattr(result, 'save') and hasattr(type(result), 'load'):
+        result.save(path)
+        return SpillHandle(path, type(result))
+    with open(path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return SpillHandle(path)
+
 # Partition function
 def partition_nodes(node_count, nodes_per_partition, shuffle=False, track_pos=False):
     nodes = np.arange(0, node_count)
@@ -57,6 +104,46 @@ def partition_nodes(node_count, nodes_per_partition, shuffle=False, track_pos=Fa
         node_bins = list(zip(range(len(node_bins)), node_bins))
     return node_bins
 
+# Cost-weighted partition function
+# Assigns items, heaviest first, to the currently lightest of n_partitions bins (LPT scheduling), so that bins
+# carry roughly equal total cost. Items within a bin keep their original order.
+def partition_by_cost(costs, n_partitions, track_pos=False):
+    costs = np.asarray(costs, dtype=np.float64)
+    n_partitions = max(1, min(int(n_partitions), len(costs)))
+    bins = [(0.0, b) for b in range(n_partitions)]
+    assignment = np.empty(len(costs), dtype=np.int64)
+    for i in np.argsort(-costs, kind='stable'):
+        cost, b = heapq.heappop(bins)
+        assignment[i] = b
+        heapq.heappush(bins, (cost + costs[i], b))
+
+    order = np.argsort(assignment, kind='stable')
+    node_bins = np.split(order, np.cumsum(np.bincount(assignment, minlength=n_partitions))[:-1])
+    node_bins = [node_bin for node_bin in node_bins if len(node_bin)]
+    if track_pos:
+        node_bins = list(zip(range(len(node_bins)), node_bins))
+    return node_bins
+
+# Platform function
+# Runs platform_function(dfs, platform_index, platform) for every platform of dfs, each on a DataFrame holding only
+# that platform, and returns the results in platform order. With n_workers > 1 platforms run concurrently in a
+# process pool.
+def map_platforms(platform_function, dfs, n_workers=1):
+    platforms = [(platform_index, platform, dfs.select_platforms([platform]))
+                 for platform_index, platform in enumerate(dfs.get_platforms())]
+    n_workers = min(n_workers, len(platforms))
+    if n_workers <= 1:
+        return [_run_platform_function(item, platform_function) for item in platforms]
+    return ProcessExecutor(n_workers).map_reduce(platforms, _run_platform_function, _collect_results,
+                                                 map_function_kwargs={'platform_function': platform_function})
+
+def _run_platform_function(item, platform_function):
+    platform_index, platform, platform_dfs = item
+    return platform_function(platform_dfs, platform_index, platform)
+
+def _collect_results(results, *args, **kwargs):
+    return list(results)
+
 # Dask client controllers
 def open_dask(n_workers=8, memory_limit='8GB', local_directory=os.getcwd()):
     config = {'n_workers': n_workers, 'memory_limit': memory_limit, 'local_directory': local_directory}
@@ -68,4 +155,133 @@ def open_dask(n_workers=8, memory_limit='8GB', local_directory=os.getcwd()):
 
 def close_dask():
     client = dask.distributed.get_client()
-    client.close()
\ No newline at end of file
+    client.close()
+
+# Executors
+# Each executor runs the same map and reduce functions (plain functions, not delayed) on a different backend
+# and returns the computed result of the reduction, or the list of SpillHandles with the spill reduce mode.
+def get_executor(backend='dask', n_workers=None, reduce_mode='concat', spill_directory=None):
+    if reduce_mode not in ('tree', 'concat', 'spill'):
+        raise ValueError(f'Unknown map_reduce reduce_mode \'{reduce_mode}\'. Use one of tree, concat or spill.')
+    if backend == 'serial':
+        return SerialExecutor(reduce_mode, spill_directory)
+    if backend == 'process':
+        return ProcessExecutor(n_workers, reduce_mode, spill_directory)
+    if backend == 'dask':
+        return DaskExecutor(reduce_mode, spill_directory)
+    raise ValueError(f'Unknown map_reduce backend \'{backend}\'. Use one of serial, process or dask.')
+
+def get_executor_from_config(cfg):
+    spill_directory = cfg.get('map_reduce.spill_directory', default='') or os.path.join(cfg.get('cache_path', default='./.cache'), 'spill')
+    return get_executor(cfg.get('map_reduce.backend', default='dask'), cfg.get('map_reduce.n_workers', default=0) or None,
+                        cfg.get('map_reduce.reduce_mode', default='concat'), spill_directory)
+
+class Executor:
+    def __init__(self, reduce_mode='concat', spill_directory=None):
+        self.reduce_mode = reduce_mode
+        self.spill_directory = spill_directory
+
+    # Wrap the map function so that it spills its result, in a fresh directory for every run
+    def _spilling(self, map_function):
+        if self.reduce_mode != 'spill':
+            return map_function
+        os.makedirs(self.spill_directory, exist_ok=True)
+        return functools.partial(map_and_spill, map_function, self._run_directory())
+
+    def _run_directory(self):
+        directory = os.path.join(self.spill_directory, uuid.uuid4().hex)
+        os.makedirs(directory)
+        return directory
+
+    # Serial and process results are already in memory, so tree and concat both reduce them in one call
+    def _reduce(self, results, reduce_function, reduce_function_kwargs):
+        if self.reduce_mode == 'spill':
+            return results
+        return reduce_function(results, **reduce_function_kwargs)
+
+class SerialExecutor(Executor):
+    # Runs every partition in the calling process, useful for debugging and small runs
+    n_workers = 1
+
+    def map_reduce(self, partition, map_function, reduce_function, scatter_data_kwargs={}, map_function_kwargs={}, reduce_function_kwargs={}):
+        map_function = self._spilling(map_function)
+        results = [map_function(indices, **scatter_data_kwargs, **map_function_kwargs) for indices in partition]
+        return self._reduce(results, reduce_function, reduce_function_kwargs)
+
+class ProcessExecutor(Executor):
+    # Runs partitions in a concurrent.futures process pool
+    # Numpy arrays and scipy sparse matrices in the kwargs are placed in shared memory once, instead of
+    # being pickled to every task
+    def __init__(self, n_workers=None, reduce_mode='concat', spill_directory=None):
+        super().__init__(reduce_mode, spill_directory)
+        self.n_workers = n_workers or os.cpu_count()
+
+    def map_reduce(self, partition, map_function, reduce_function, scatter_data_kwargs={}, map_function_kwargs={}, reduce_function_kwargs={}):
+        map_function = self._spilling(map_function)
+        blocks = []
+        try:
+            shared_kwargs = {key: _share(value, blocks) for key, value in {**scatter_data_kwargs, **map_function_kwargs}.items()}
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.n_workers, initializer=_attach_shared_kwargs,
+                                                        initargs=(shared_kwargs,)) as pool:
+                # Tasks are pulled by idle workers, and results are kept in partition order
+                results = list(pool.map(_run_map_function, [map_function] * len(partition), partition))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        return self._reduce(results, reduce_function, reduce_function_kwargs)
+
+class DaskExecutor(Executor):
+    # Runs partitions on the Dask client opened with open_dask() through map_reduce()
+    @property
+    def n_workers(self):
+        return len(dask.distributed.get_client().scheduler_info()['workers'])
+
+    def map_reduce(self, partition, map_function, reduce_function, scatter_data_kwargs={}, map_function_kwargs={}, reduce_function_kwargs={}):
+        return map_reduce(partition, dask.delayed(self._spilling(map_function)), dask.delayed(reduce_function),
+                          scatter_data_kwargs=scatter_data_kwargs, map_function_kwargs=map_function_kwargs,
+                          reduce_function_kwargs=reduce_function_kwargs, reduce_mode=self.reduce_mode).compute()
+
+# Shared memory helpers for the process executor
+_shared_kwargs = {}
+_shared_blocks = []
+
+def _share(value, blocks):
+    if isinstance(value, dict):
+        return ('dict', {key: _share(v, blocks) for key, v in value.items()})
+    if ss.issparse(value) and value.format in ('csr', 'csc'):
+        return (value.format, value.shape, [_share_array(a, blocks) for a in (value.data, value.indices, value.indptr)])
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        return ('ndarray', _share_array(value, blocks))
+    return ('object', value)
+
+def _share_array(array, blocks):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return (block.name, array.dtype.str, array.shape)
+
+def _attach(descriptor):
+    kind, *content = descriptor
+    if kind == 'dict':
+        return {key: _attach(v) for key, v in content[0].items()}
+    if kind in ('csr', 'csc'):
+        shape, arrays = content
+        matrix = ss.csr_matrix if kind == 'csr' else ss.csc_matrix
+        return matrix(tuple(_attach_array(a) for a in arrays), shape=shape, copy=False)
+    if kind == 'ndarray':
+        return _attach_array(content[0])
+    return content[0]
+
+def _attach_array(descriptor):
+    name, dtype, shape = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    _shared_blocks.append(block)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+def _attach_shared_kwargs(shared_kwargs):
+    global _shared_kwargs
+    _shared_kwargs = {key: _attach(value) for key, value in shared_kwargs.items()}
+
+def _run_map_function(map_function, indices):
+    return map_function(indices, **_shared_kwargs)
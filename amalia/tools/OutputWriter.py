@@ -2,6 +2,7 @@ import hashlib
 import json
 import logging
 import sys
+import types
 from zipfile import ZipFile
 
 import pandas as pd
@@ -9,6 +10,7 @@ import numpy as np
 import os
 import subprocess
 from amalia.tools.ConfigHandler import ConfigHandler
+from tools.EventBuffer import EventBuffer, SpilledEvents
 from pathlib import Path
 
 logger = logging.getLogger(__name__.split('.')[-1])
@@ -31,6 +33,7 @@ class OutputWriter:
         self.write_config = cfg.get('output.write_config', default=True)
         self.id_sep = cfg.get('output.id_sep', default='$$$', type=str)
         self.lines = cfg.get('output.lines', default=True)
+        self.chunk_size = cfg.get('output.chunk_size', default=1000000, type=int)
 
         if cfg.get('output.include_git_hash', default=False):
             self.identifier += 'GIT' + _get_git_hash()
@@ -45,14 +48,21 @@ class OutputWriter:
             'identifier': self.identifier,
         }
 
+    def _restore_ids(self, df):
+        # Interned ID columns arrive as categoricals over the DataFrame's IdTable, see dataframe.DataFrame
+        for name in ['nodeID', 'parentID', 'rootID']:
+            if name in df and isinstance(df[name].dtype, pd.CategoricalDtype):
+                df[name] = df[name].astype(object)
+        return df
+
     def _separate_ids(self, df):
-        results = []
-        for row in df.to_dict('records'):
-            for nodeUserID in row['nodeUserID'].split(self.id_sep):
-                results.append(row)
-                results[-1]['nodeUserID'] = nodeUserID
+        df = df.reset_index(drop=True)
+        user_ids = df['nodeUserID']
+        if user_ids.dtype != object or not user_ids.str.contains(self.id_sep, regex=False).any():
+            return df
 
-        return pd.DataFrame.from_records(results)
+        df['nodeUserID'] = user_ids.str.split(self.id_sep, regex=False)
+        return df.explode('nodeUserID', ignore_index=True)
 
     def _change_types(self, df):
         if df.dtypes['nodeTime'] in [float, np.float32, np.float64]:
@@ -64,6 +74,16 @@ class OutputWriter:
 
     def write(self, result):
         logger.info(f"Writing results for {self.identifier} in {self.destination}")
+        if isinstance(result, SpilledEvents) and self.lines:
+            self._write_chunks(result.iter_chunks(self.chunk_size))
+            return result
+        if isinstance(result, types.GeneratorType):
+            if self.lines:
+                self._write_chunks(result)
+                return None
+            result = _concat_chunks(result)
+        if isinstance(result, (EventBuffer, SpilledEvents)):
+            result = result.to_frame()
         if type(result) != pd.DataFrame:
             logger.error(f'Trying write non pandas dataframe type {type(result)}. Terminating')
             raise ValueError(f'Cannot write type {type(result)}.')
@@ -71,6 +91,7 @@ class OutputWriter:
         if not (self.destination / self.identifier).exists():
             os.mkdir(self.destination / self.identifier)
 
+        result = self._restore_ids(result)
         result = self._separate_ids(result)
         self._change_types(result)
 
@@ -86,17 +107,45 @@ class OutputWriter:
                 self._write_structured(output_file, result)
             logger.debug(f"Wrote output file for {self.identifier}.")
 
+        self._write_node_list(result['nodeUserID'].unique())
+        self._write_config()
+
+        return result
+
+    def _write_chunks(self, chunks):
+        '''
+        Write time-ordered EventBuffer chunks, such as spilled partitions merged by SpilledEvents or the
+        output of a simulation's stream(), one at a time so the full result is never materialized.
+        '''
+        if not (self.destination / self.identifier).exists():
+            os.mkdir(self.destination / self.identifier)
+
+        node_ids = set()
+        with open(self.destination / self.identifier / (self.identifier + '.ndjson'), 'w') as output_file:
+            output_file.write(json.dumps(self._build_header()))
+            output_file.write('\n')
+            for chunk in chunks:
+                chunk = self._separate_ids(chunk.to_frame())
+                self._change_types(chunk)
+                # Older Pandas versions do not end the last record with a newline
+                output_file.write(chunk.to_json(orient='records', lines=True).rstrip('\n') + '\n')
+                node_ids.update(chunk['nodeUserID'].unique())
+            logger.debug(f"Wrote output file for {self.identifier}.")
+
+        self._write_node_list(node_ids)
+        self._write_config()
+
+    def _write_node_list(self, node_ids):
         with open(self.destination / self.identifier / 'node_list.txt', 'w') as node_list:
-            for info_id in result['nodeUserID'].unique():
+            for info_id in node_ids:
                 node_list.write(info_id + '\n')
 
+    def _write_config(self):
         if self.write_config:
             with open(self.destination / self.identifier / 'config.yaml', 'w') as config_file:
                 config_file.write(self.config_string)
                 logger.debug(f"Wrote config file for {self.identifier}.")
 
-        return result
-
     def _write_lines(self, output_file, result):
         output_file.write(json.dumps(self._build_header()))
         output_file.write('\n')
@@ -109,6 +158,13 @@ class OutputWriter:
         json.dump(doc, output_file)
 
 
+def _concat_chunks(chunks):
+    result = None
+    for chunk in chunks:
+        result = chunk if result is None else result.extend(chunk)
+    return EventBuffer() if result is None else result
+
+
 def _get_git_hash():
     working_directory = Path(os.path.abspath(__file__)).parent  # get the directory in which this file lives
     p = subprocess.Popen(['git', 'log', '--pretty=format:%h', '-n', '1'], cwd=str(working_directory),
@@ -1,5 +1,8 @@
 from collections import defaultdict
 
+import numpy as np
+import scipy.sparse as ss
+
 
 def get_time_bins(max_time, min_time, time_delta):
     """
@@ -8,6 +11,24 @@ def get_time_bins(max_time, min_time, time_delta):
     return ((max_time - (max_time % time_delta)) - min_time) // time_delta
 
 
+def grow_sparse(matrix, shape):
+    """
+    Returns a csr or csc `matrix` padded with empty rows and columns to `shape`, without copying its entries
+    """
+    n_major = shape[0] if matrix.format == 'csr' else shape[1]
+    padding = np.full(n_major - (len(matrix.indptr) - 1), matrix.indptr[-1], dtype=matrix.indptr.dtype)
+    indptr = np.concatenate((matrix.indptr, padding))
+    return type(matrix)((matrix.data, matrix.indices, indptr), shape=shape, copy=False)
+
+
+def scale_rows(matrix, factors):
+    """
+    Scales every row of a csr `matrix` in place by the matching entry of `factors`, through its `indptr` and `data`
+    """
+    matrix.data *= np.repeat(np.asarray(factors, dtype=matrix.data.dtype), np.diff(matrix.indptr))
+    return matrix
+
+
 def dataframe_to_dict_array(df):
     results = {}
     for idx, dat in df.iterrows():
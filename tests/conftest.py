@@ -0,0 +1,5 @@
+import os
+import sys
+
+# AMALIA modules import each other as top-level packages (tools, simulation, ...)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'amalia'))
@@ -0,0 +1,154 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from archetypes.ResponseTypeArchetype import ResponseTypeArchetype
+from archetypes.TimeSeriesArchetype import TimeSeriesArchetype
+from dataframe.DataFrame import DataFrame
+from features.ResponseTypeFeature import ResponseTypeFeature
+from tools.ConfigHandler import TestConfigHandler as ConfigStub
+from tools.Utilities import get_time_bins
+
+
+def _config():
+    cfg = ConfigStub()
+    cfg.set('limits', {'time_delta': '1d'})
+    cfg.set('time_series_archetype', {'base_actions': {'Twitter': 'tweet'}})
+    cfg.set('response_type_archetype', {'response_types': {'Twitter': ['reply', 'retweet']}})
+    return cfg
+
+
+def _events(n_days, n_users, seed):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_days * 20):
+        day = i // 20
+        node_id = f'n{i}'
+        if rows and rng.random() < 0.5:
+            parent = rows[rng.integers(len(rows))]['nodeID']
+            action = rng.choice(['reply', 'retweet'])
+        else:
+            parent, action = node_id, 'tweet'
+        rows.append({'nodeID': node_id, 'nodeUserID': f'u{rng.integers(n_users + day):03d}', 'parentID': parent,
+                     'rootID': parent, 'actionType': action, 'nodeTime': 1514764800 + day * 86400 + i % 20 * 60})
+    return pd.DataFrame(rows)
+
+
+def test_append_updates_archetypes_incrementally(tmp_path):
+    events = _events(4, 5, 0)
+    first, rest = events.iloc[:60], events.iloc[60:]
+    first.to_csv(tmp_path / 'first.csv', index=False)
+    rest.to_csv(tmp_path / 'rest.csv', index=False)
+    events.to_csv(tmp_path / 'all.csv', index=False)
+
+    cfg = _config()
+    dfs = DataFrame({'Twitter': str(tmp_path / 'first.csv')})
+    time_series = TimeSeriesArchetype(cfg).compute(dfs)
+    responses = ResponseTypeArchetype(cfg).compute(dfs)
+    users = list(dfs.get_node_map('Twitter'))
+
+    new_rows = dfs.append('Twitter', str(tmp_path / 'rest.csv'))
+    assert dfs.get_node_map('Twitter')[:len(users)] == users
+    TimeSeriesArchetype(cfg).append(time_series, dfs, 'Twitter', new_rows)
+    ResponseTypeArchetype(cfg).append(responses, dfs, 'Twitter', new_rows)
+
+    # Users are ordered differently in a fresh load, so compare by user
+    full = DataFrame({'Twitter': str(tmp_path / 'all.csv')})
+    order = [full.get_reverse_node_map('Twitter')[user] for user in dfs.get_node_map('Twitter')]
+    expected = TimeSeriesArchetype(cfg).compute(full)['Twitter'][order]
+    assert (time_series['Twitter'] != expected).nnz == 0
+    for action, matrix in ResponseTypeArchetype(cfg).compute(full)['Twitter'].items():
+        assert (responses['Twitter'][action] != matrix[order][:, order]).nnz == 0
+
+    # Reloading the dataset appends the data again with the same user indices
+    reloaded = pickle.loads(pickle.dumps(dfs))
+    assert reloaded.get_node_map('Twitter') == dfs.get_node_map('Twitter')
+    columns = ['nodeUserID', 'userIdx', 'actionType', 'nodeTime']
+    pd.testing.assert_frame_equal(reloaded.get_df('Twitter')[columns], dfs.get_df('Twitter')[columns])
+
+
+def test_response_counts_match_pairwise_count(tmp_path):
+    import collections
+
+    events = _events(3, 8, 1)
+    events.loc[5, 'parentID'] = None
+    events.loc[7, 'parentID'] = 'unknown'
+    events.to_csv(tmp_path / 'events.csv', index=False)
+    dfs = DataFrame({'Twitter': str(tmp_path / 'events.csv')})
+    responses = ResponseTypeArchetype(_config()).compute(dfs)['Twitter']
+
+    users = dict(zip(events['nodeID'], events['nodeUserID']))
+    node_map = dfs.get_node_map('Twitter')
+    for action in ['reply', 'retweet']:
+        rows = events[(events['actionType'] == action) & events['parentID'].isin(list(users))]
+        expected = collections.Counter((node_map.index(user), node_map.index(users[parent]))
+                                       for user, parent in zip(rows['nodeUserID'], rows['parentID']))
+        matrix = responses[action].tocoo()
+        assert dict(zip(zip(matrix.row, matrix.col), matrix.data)) == expected
+        assert responses[action].format == 'csr' and responses[action].shape == (len(node_map), len(node_map))
+
+
+def test_pyramid_levels_match_direct_binning(tmp_path):
+    rng = np.random.default_rng(2)
+    n = 500
+    # Starts off any bin boundary, so the first events fall in the clamped bin
+    times = 1514764800 + 1234 + np.sort(rng.integers(0, 20 * 86400, n))
+    events = pd.DataFrame({'nodeID': [f'n{i}' for i in range(n)], 'nodeUserID': rng.integers(0, 30, n).astype(str),
+                           'parentID': [f'n{i}' for i in range(n)], 'rootID': [f'n{i}' for i in range(n)],
+                           'actionType': 'tweet', 'nodeTime': times})
+    events.to_csv(tmp_path / 'events.csv', index=False)
+    dfs = DataFrame({'Twitter': str(tmp_path / 'events.csv')})
+
+    cfg = _config()
+    cfg.set('time_series_archetype', {'base_actions': {'Twitter': 'tweet'}, 'resolutions': ['1h', '6h', '1d']})
+    pyramid = TimeSeriesArchetype(cfg)
+    for delta in ['1h', '6h', '1d']:
+        cfg.set('limits', {'time_delta': delta})
+        direct = TimeSeriesArchetype(_config())._bin(dfs, pd.Timedelta(delta).total_seconds())['Twitter']
+        derived = pyramid.compute_resolution(dfs, pd.Timedelta(delta).total_seconds())['Twitter']
+        assert derived.format == 'csc' and derived.shape == direct.shape
+        assert (derived != direct).nnz == 0 and derived.sum() == n
+
+    cfg.set('limits', {'time_delta': '1d'})
+    assert TimeSeriesArchetype(cfg).compute(dfs)['Twitter'] is pyramid.compute_resolution(dfs, 86400.0)['Twitter']
+
+
+def test_response_probabilities_scale_rows_by_activity(tmp_path):
+    _events(3, 6, 2).to_csv(tmp_path / 'events.csv', index=False)
+    cfg = _config()
+    dfs = DataFrame({'Twitter': str(tmp_path / 'events.csv')})
+    counts = ResponseTypeArchetype(cfg).compute(dfs)['Twitter']
+    activity = np.asarray(TimeSeriesArchetype(cfg).compute(dfs)['Twitter'].sum(axis=1)).ravel()
+
+    probabilities = ResponseTypeFeature(cfg).compute(dfs)['Twitter']
+    for action, matrix in counts.items():
+        expected = matrix.toarray() / np.maximum(activity, 1)[:, None]
+        assert np.allclose(probabilities[action].toarray(), expected, rtol=1e-12)
+        # The counts are left as they are
+        assert matrix.dtype.kind == 'i'
+
+    cfg.set('response_type_feature', {'dtype': 'float32'})
+    single = ResponseTypeFeature(cfg).compute(dfs)['Twitter']
+    for action, matrix in single.items():
+        assert matrix.dtype == np.float32
+        assert np.allclose(matrix.toarray(), probabilities[action].toarray(), rtol=1e-6)
+
+
+def test_window_matches_slice_of_full_time_series(tmp_path):
+    _events(6, 5, 3).to_csv(tmp_path / 'events.csv', index=False)
+    dfs = DataFrame({'Twitter': str(tmp_path / 'events.csv')})
+    min_time = dfs.get_time_range('Twitter')[0]
+
+    for resolutions in [[], ['12h']]:
+        cfg = _config()
+        cfg.set('time_series_archetype', {'base_actions': {'Twitter': 'tweet'}, 'resolutions': resolutions})
+        archetype = TimeSeriesArchetype(cfg)
+        full = archetype.compute(dfs)['Twitter']
+        for start, end in [(1, 3), (0, 6), (-2, 2), (4, 20), (3, 3), (5, 2)]:
+            start_date, end_date = min_time + start * 86400 + 3600, min_time + end * 86400 + 3600
+            expected = full[:, int(get_time_bins(start_date, min_time, 86400)):
+                               int(get_time_bins(end_date, min_time, 86400))]
+            window = archetype.compute_window(dfs, start_date, end_date)['Twitter']
+            assert window.shape == expected.shape
+            assert (window != expected).nnz == 0
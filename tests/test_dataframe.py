@@ -0,0 +1,211 @@
+import pandas as pd
+
+from dataframe.DataFrame import DataFrame
+from tools.MapReduce import map_platforms
+
+
+def _write(tmp_path, name, users):
+    df = pd.DataFrame({'nodeID': [f'{name}{i}' for i in range(len(users))], 'nodeUserID': users,
+                       'parentID': [f'{name}{i}' for i in range(len(users))],
+                       'rootID': [f'{name}{i}' for i in range(len(users))], 'actionType': 'tweet',
+                       'nodeTime': [f'2018-04-1{i} 00:00:00' for i in range(len(users))]})
+    df.to_csv(tmp_path / f'{name}.csv', index=False)
+    return str(tmp_path / f'{name}.csv')
+
+
+def _describe(dfs, platform_index, platform):
+    return platform_index, platform, dfs.get_platforms(), dfs.get_node_map(platform)
+
+
+def test_select_platforms_and_map_platforms(tmp_path):
+    dfs = DataFrame({'Twitter': _write(tmp_path, 't', ['b', 'a', 'b']), 'YouTube': _write(tmp_path, 'y', ['c'])})
+
+    subset = dfs.select_platforms(['YouTube'])
+    assert subset.get_platforms() == ['YouTube']
+    assert subset.get_df('YouTube') is dfs.get_df('YouTube')
+
+    expected = [(0, 'Twitter', ['Twitter'], ['a', 'b']), (1, 'YouTube', ['YouTube'], ['c'])]
+    assert map_platforms(_describe, dfs) == expected
+    assert map_platforms(_describe, dfs, n_workers=2) == expected
+
+
+def test_parse_node_times_matches_mktime(monkeypatch):
+    import time
+    from datetime import datetime
+    from dataframe.DataFrame import parse_node_times
+
+    # Includes a time skipped by the DST change, and an ambiguous one, for which glibc's mktime picks either
+    # offset depending on its previous calls
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    try:
+        values = ['2018-04-12 21:48:35', '2018-03-11 02:30:00', '2018-01-01 00:00:00']
+        expected = [time.mktime(datetime.strptime(v, '%Y-%m-%d %H:%M:%S').timetuple()) for v in values]
+        assert parse_node_times(pd.Series(values)).tolist() == expected
+
+        iso = pd.Series([v.replace(' ', 'T') + 'Z' for v in values])
+        assert parse_node_times(iso).tolist() == expected
+
+        assert parse_node_times(pd.Series(['2018-11-04 01:30:00'])).iloc[0] in [1541309400, 1541313000]
+    finally:
+        monkeypatch.delenv('TZ')
+        time.tzset()
+
+
+def test_parse_node_times_numeric_and_utc():
+    from dataframe.DataFrame import parse_node_times
+
+    numeric = pd.Series([1523569715, 1523569716])
+    assert parse_node_times(numeric) is numeric
+    assert parse_node_times(pd.Series(['1523569715'])).tolist() == [1523569715]
+    assert parse_node_times(pd.Series(['2018-04-12 21:48:35']), timezone='UTC').tolist() == [1523569715.0]
+
+
+def test_ingest_cache_round_trip(tmp_path):
+    import os
+    from dataframe.DataFrame import load
+
+    path = _write(tmp_path, 't', ['b', 'a', 'b'])
+    df = pd.read_csv(path)
+    df.loc[1, 'parentID'] = None
+    df.to_csv(path, index=False)
+    cache = str(tmp_path / 'ingest')
+
+    parsed = load({'Twitter': path}, cache_directory=cache)['Twitter']
+    assert len(os.listdir(cache)) == 1
+    cached = load({'Twitter': path}, cache_directory=cache)['Twitter']
+    pd.testing.assert_frame_equal(cached, parsed.reset_index(drop=True))
+    assert cached['parentID'].isna().tolist() == [False, True, False]
+
+    # A changed file gets a new copy
+    df.iloc[:2].to_csv(path, index=False)
+    os.utime(path, ns=(0, 0))
+    assert len(load({'Twitter': path}, cache_directory=cache)['Twitter']) == 2
+    assert len(os.listdir(cache)) == 2
+
+
+def test_directory_load_merges_sorted_files(tmp_path):
+    import numpy as np
+    from dataframe.DataFrame import load
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(5):
+        times = rng.integers(1514764800, 1514764800 + 50, 40)
+        frame = pd.DataFrame({'nodeID': [f'{i}-{j}' for j in range(40)], 'nodeUserID': rng.integers(0, 5, 40),
+                              'parentID': '007', 'rootID': '007', 'actionType': rng.choice(['tweet', 'retweet'], 40),
+                              'nodeTime': times})
+        frame.to_csv(tmp_path / f'{i}.csv', index=False)
+        frames.append(frame)
+
+    df = load({'Twitter': str(tmp_path) + '/'}, n_workers=3)['Twitter']
+    files = sorted(tmp_path.iterdir())
+    expected = pd.concat([pd.read_csv(f, dtype=str) for f in files], ignore_index=True)
+    expected = expected.iloc[np.argsort(expected['nodeTime'].astype(int).to_numpy(), kind='stable')]
+    assert df['nodeID'].tolist() == expected['nodeID'].tolist()
+    assert df['nodeTime'].dtype == np.float64 and df['nodeTime'].is_monotonic_increasing
+    assert isinstance(df['actionType'].dtype, pd.CategoricalDtype)
+    assert df['parentID'].iloc[0] == '007' and df['nodeUserID'].map(type).eq(str).all()
+
+
+def test_load_time_window_and_columns(tmp_path, monkeypatch):
+    import dataframe.DataFrame as DataFrameModule
+    from dataframe.DataFrame import load
+
+    path = _write(tmp_path, 't', ['a', 'b', 'c', 'd', 'e'])
+    full = load({'Twitter': path})['Twitter']
+    times = full['nodeTime'].tolist()
+    expected = full.iloc[1:4][['nodeUserID', 'actionType', 'nodeTime']].reset_index(drop=True)
+    monkeypatch.setattr(DataFrameModule, 'CSV_CHUNK_SIZE', 2)
+
+    options = {'start_date': times[1], 'end_date': times[3], 'columns': ['actionType']}
+    cache = str(tmp_path / 'ingest')
+    for cache_directory in [None, cache, cache]:
+        df = load({'Twitter': path}, cache_directory=cache_directory, **options)['Twitter']
+        pd.testing.assert_frame_equal(df.reset_index(drop=True), expected)
+
+
+def test_user_index_matches_node_map(tmp_path):
+    import numpy as np
+
+    dfs = DataFrame({'Twitter': _write(tmp_path, 't', ['b', 'a', 'c', 'b'])})
+    df = dfs.get_df('Twitter')
+    assert df['userIdx'].dtype == np.int32
+    assert [dfs.get_node_map('Twitter')[i] for i in df['userIdx']] == df['nodeUserID'].tolist()
+    assert dfs.get_reverse_node_map('Twitter') == {'a': 0, 'b': 1, 'c': 2}
+
+
+def test_id_columns_are_interned(tmp_path):
+    import numpy as np
+
+    dfs = DataFrame({'Twitter': _write(tmp_path, 't', ['a', 'b']), 'YouTube': _write(tmp_path, 'y', ['c'])})
+    twitter, youtube = dfs.get_df('Twitter'), dfs.get_df('YouTube')
+    assert twitter['nodeID'].dtype == np.int64
+    assert (twitter['nodeID'] == twitter['parentID']).all()
+    assert dfs.id_table.decode(twitter['nodeID']).tolist() == ['t0', 't1']
+    assert dfs.id_table.decode(youtube['rootID']).tolist() == ['y0']
+
+    keys = dfs.id_table.intern(['t1', None, 'z'])
+    assert keys.tolist() == [twitter['nodeID'].iloc[1], -1, len(dfs.id_table) - 1]
+    assert dfs.id_table.categorical(keys).tolist()[::2] == ['t1', 'z']
+
+
+def test_json_and_ndjson_loading(tmp_path):
+    import json
+    from dataframe.DataFrame import load
+    from dataframe.NdjsonRecords import NdjsonRecords
+
+    (tmp_path / 'doc.json').write_text(json.dumps({'a': 1}, indent=2))
+    (tmp_path / 'line.json').write_text(json.dumps({'a': 1}))
+    records = [{'id': i, 'name': f'n{i}', 'extra': [i]} for i in range(5)]
+    (tmp_path / 'records.json').write_text('\n'.join(json.dumps(r) for r in records) + '\n\n')
+
+    res = load({'doc': str(tmp_path / 'doc.json'), 'line': str(tmp_path / 'line.json'),
+                'records': str(tmp_path / 'records.json')}, json_keys={'records': ['id', 'missing']})
+    assert res['doc'] == {'a': 1} and res['line'] == {'a': 1}
+    assert isinstance(res['records'], NdjsonRecords)
+    assert list(res['records']) == [{'id': i, 'missing': None} for i in range(5)]
+    assert [len(chunk) for chunk in res['records'].iter_chunks(2)] == [2, 2, 1]
+    assert res['records'].to_frame()['id'].tolist() == list(range(5))
+
+
+def test_datasets_load_lazily_within_memory_budget(tmp_path):
+    import pickle
+
+    dfs = DataFrame({'Twitter': _write(tmp_path, 't', ['a', 'b']), 'YouTube': _write(tmp_path, 'y', ['c'])},
+                    memory_budget=1)
+    assert dfs.get_platforms() == ['Twitter', 'YouTube'] and len(dfs.dataframes) == 0
+
+    twitter = dfs.get_df('Twitter')
+    assert list(dfs.dataframes) == ['Twitter']
+    assert dfs.get_node_map('YouTube') == ['c']
+    assert list(dfs.dataframes) == ['YouTube']
+
+    # Reloaded datasets keep their node map and ID keys
+    reloaded = dfs.get_df('Twitter')
+    assert reloaded is not twitter and dfs.get_node_map('Twitter') == ['a', 'b']
+    pd.testing.assert_frame_equal(reloaded, twitter)
+
+    unpickled = pickle.loads(pickle.dumps(dfs))
+    assert len(unpickled.dataframes) == 0
+    assert unpickled.get_df('YouTube')['nodeUserID'].tolist() == ['c']
+
+
+def test_slice_time_uses_sorted_index(tmp_path):
+    import numpy as np
+    from dataframe.DataFrame import time_bounds
+
+    dfs = DataFrame({'Twitter': _write(tmp_path, 't', ['a', 'b', 'c', 'd'])})
+    df = dfs.get_df('Twitter')
+    times = dfs.get_time_index('Twitter')
+    assert np.shares_memory(times, df['nodeTime'].to_numpy())
+    assert dfs.get_time_range('Twitter') == (times[0], times[-1])
+
+    window = dfs.slice_time('Twitter', times[1], times[3])
+    assert window['nodeUserID'].tolist() == ['b', 'c']
+    assert np.shares_memory(window['nodeTime'].to_numpy(), times)
+    assert len(dfs.slice_time('Twitter')) == 4 and len(dfs.slice_time('Twitter', times[3] + 1)) == 0
+
+    assert time_bounds(times, times[1], times[3], closed='both') == (1, 4)
+    assert time_bounds(times, times[1], times[3], closed='neither') == (2, 3)
+    assert time_bounds(times, times[3], times[1]) == (3, 3)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from tools.EventBuffer import EventBuffer
+
+
+def _fill(buffer):
+    buffer.append(np.array(['a', 'b', 'c'], dtype=object), [0, 1, 1], [30., 10., 20.], 'tweet', 'Twitter',
+                  ['u0', 'u1'])
+    buffer.append(np.array(['d', 'e'], dtype=object), [1, 0], [15., 5.], np.array(['reply', 'quote'], dtype=object),
+                  'Twitter', ['u0', 'u1'], parent_ids=np.array(['a', 'b'], dtype=object))
+    return buffer
+
+
+def test_append_grows_and_restores_schema():
+    buffer = _fill(EventBuffer(capacity=1))
+    df = buffer.to_frame()
+
+    assert len(buffer) == 5
+    assert df.columns.tolist() == ['nodeID', 'nodeUserID', 'parentID', 'rootID', 'actionType', 'nodeTime',
+                                   'platform']
+    assert df['nodeUserID'].tolist() == ['u0', 'u1', 'u1', 'u1', 'u0']
+    assert df['actionType'].tolist() == ['tweet', 'tweet', 'tweet', 'reply', 'quote']
+    assert df['rootID'].tolist() == ['a', 'b', 'c', 'a', 'b']
+
+
+def test_sort_and_extend():
+    buffer = _fill(EventBuffer())
+    other = EventBuffer()
+    other.append(np.array(['f'], dtype=object), [0], [12.], 'video', 'YouTube', ['y0'])
+    buffer.extend(other).sort_by_time()
+    df = buffer.to_frame()
+
+    assert df['nodeID'].tolist() == ['e', 'b', 'f', 'd', 'c', 'a']
+    assert df.loc[2, 'nodeUserID'] == 'y0'
+    assert df.loc[2, 'platform'] == 'YouTube'
+    assert df.loc[2, 'actionType'] == 'video'
+
+
+def test_spilled_events_merge_in_time_order(tmp_path):
+    from tools.EventBuffer import SpilledEvents
+    from tools.EventGeneration import NodeIdGenerator
+    from tools.MapReduce import SpillHandle
+
+    rng = np.random.default_rng(0)
+    handles = []
+    expected = []
+    for pos in range(3):
+        buffer = EventBuffer(id_generator=NodeIdGenerator(0, stream=pos))
+        times = rng.integers(0, 50, size=40).astype(float)
+        buffer.append(buffer.id_generator.generate(40, as_int=True), rng.integers(0, 2, size=40), times, 'tweet',
+                      'Twitter', ['u0', 'u1'])
+        buffer.sort_by_time().save(tmp_path / str(pos))
+        handles.append(SpillHandle(str(tmp_path / str(pos)), EventBuffer))
+        expected.append(buffer.to_frame())
+
+    spilled = SpilledEvents(handles, {'Twitter': ['u0', 'u1']})
+    chunks = [chunk.to_frame() for chunk in spilled.iter_chunks(chunk_size=16)]
+    merged = spilled.to_frame()
+
+    assert len(spilled) == 120
+    assert len(chunks) > 1
+    assert np.all(np.diff(merged['nodeTime']) >= 0)
+    assert sorted(merged['nodeID']) == sorted(np.concatenate([df['nodeID'] for df in expected]))
@@ -0,0 +1,137 @@
+import collections
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from tools.EventBuffer import EventBuffer
+from tools.EventGeneration import NodeIdGenerator, EventStreams, expand_event_counts, sample_responses, stream_events, \
+    generate_responses
+from simulation.PoissonSimulation import _generate_base_event
+from simulation.VectorizedPoissonSimulation import _generate_base_events
+from simulation.ParallelPoissonSimulation import _worker_generate_base_event, _build_work_items
+
+
+def test_expand_event_counts():
+    rows, cols = expand_event_counts(csr_matrix([[0, 2, 0], [1, 0, 3]]))
+    assert rows.tolist() == [0, 0, 1, 1, 1, 1]
+    assert cols.tolist() == [1, 1, 0, 2, 2, 2]
+
+
+def _replay():
+    ts = csr_matrix(np.array([[0, 2, 0, 1], [1, 0, 3, 0], [0, 0, 0, 0], [4, 1, 0, 2]], dtype=np.uint32))
+    responses = {'reply': csr_matrix(np.array([[0, .9, .5, 0], [.2, 0, 0, .7], [0, 0, 0, 0], [.6, .6, .1, 0]])),
+                 'quote': csr_matrix(np.array([[0, 0, .3, 0], [0, 0, 0, 0], [.5, 0, 0, 0], [0, .8, 0, 0]]))}
+    return ts, responses, ['a', 'b', 'c', 'd'], 1523318400
+
+
+def _poisson(ts, responses, node_map, start_date, generate_replies=True):
+    streams = EventStreams(ts, responses, 0)
+    buffer = EventBuffer(id_generator=NodeIdGenerator(0))
+    return _generate_base_event(buffer, streams, ts, node_map, np.unique(ts.nonzero()[0]), start_date, responses,
+                                generate_replies, 'Twitter').sort_by_time().to_frame()
+
+
+def test_vectorized_base_events_match_poisson():
+    ts, responses, node_map, start_date = _replay()
+    expected = _poisson(ts, responses, node_map, start_date, generate_replies=False)
+
+    buffer = EventBuffer(id_generator=NodeIdGenerator(0))
+    __, user_ind, event_ind, __ = _generate_base_events(buffer, EventStreams(ts, responses, 0), ts, node_map,
+                                                        start_date, 86400, 'tweet', 'Twitter')
+    result = buffer.sort_by_time().to_frame()
+
+    assert result.equals(expected)
+    assert (result['nodeID'] == result['parentID']).all()
+    assert result['nodeID'].nunique() == len(result)
+    assert user_ind.tolist() == [0, 0, 0, 1, 1, 1, 1, 3, 3, 3, 3, 3, 3, 3]
+    assert event_ind.tolist() == [0, 1, 2, 0, 1, 2, 3, 0, 1, 2, 3, 4, 5, 6]
+
+
+def test_parallel_events_do_not_depend_on_partitioning():
+    ts, responses, node_map, start_date = _replay()
+    expected = _poisson(ts, responses, node_map, start_date)
+    streams = EventStreams(ts, responses, 0)
+
+    assert expected['nodeID'].nunique() == len(expected)
+    assert (expected['actionType'] != 'tweet').any()
+    for n_bins in [1, 2, 5]:
+        items, __ = _build_work_items(ts, np.array([0, 1, 3]), responses, n_bins)
+        buffers = [_worker_generate_base_event(('Twitter', items[i::n_bins]), {'Twitter': ts}, {'Twitter': node_map},
+                                               start_date, {'Twitter': responses}, True, {'Twitter': streams})
+                   for i in range(n_bins)]
+        result = buffers[0]
+        for buffer in buffers[1:]:
+            result.extend(buffer)
+        assert result.sort_by_time().to_frame().equals(expected)
+
+
+def test_streamed_events_match_poisson():
+    ts, responses, node_map, start_date = _replay()
+    expected = _poisson(ts, responses, node_map, start_date)
+
+    platforms = [('Twitter', ts, responses, node_map, EventStreams(ts, responses, 0), 'tweet')]
+    chunks = [chunk.to_frame() for chunk in stream_events(platforms, start_date, 86400, NodeIdGenerator(0))]
+
+    assert len(chunks) == ts.shape[1]
+    assert all(a['nodeTime'].max() < b['nodeTime'].min() for a, b in zip(chunks, chunks[1:]))
+    assert pd.concat(chunks, ignore_index=True).equals(expected)
+
+
+def test_streamed_events_carry_late_responses():
+    # Responses land up to an hour after their root, beyond the next 10 minute time bin
+    ts, responses, node_map, start_date = _replay()
+    streams = EventStreams(ts, responses, 0)
+    buffer = EventBuffer(id_generator=NodeIdGenerator(0))
+    node_ids, user_ind, event_ind, node_times = _generate_base_events(buffer, streams, ts, node_map, start_date, 600,
+                                                                      'tweet', 'Twitter')
+    generate_responses(buffer, streams, node_ids, user_ind, event_ind, node_times, responses, node_map, 'Twitter')
+    expected = buffer.sort_by_time().to_frame()
+
+    chunks = [chunk.to_frame() for chunk in
+              stream_events([('Twitter', ts, responses, node_map, streams, 'tweet')], start_date, 600,
+                            NodeIdGenerator(0))]
+
+    assert pd.concat(chunks, ignore_index=True).equals(expected)
+
+
+def _sample_per_event(probabilities, root_rows, seed):
+    # Original per-event rule: every user at or above the event's threshold responds
+    thresholds = np.random.default_rng(seed).random(len(root_rows))
+    res = []
+    for i, (row, threshold) in enumerate(zip(root_rows, thresholds)):
+        p = probabilities.getrow(row).toarray()[0]
+        res += [(i, j) for j in np.flatnonzero((p != 0) & (p >= threshold))]
+    return sorted(res)
+
+
+def test_sample_responses_matches_per_event_rule():
+    probabilities = csr_matrix(np.random.default_rng(0).random((6, 6)) * (np.eye(6) == 0))
+    probabilities.data[::4] = 0
+    root_rows = np.array([0, 3, 3, 5, 1, 3, 2])
+
+    expected = _sample_per_event(probabilities, root_rows, 7)
+    for chunk_size in [1, 3, 2 ** 22]:
+        root_ind, users = sample_responses(probabilities, root_rows, rng=np.random.default_rng(7),
+                                           chunk_size=chunk_size)
+        assert sorted(zip(root_ind.tolist(), users.tolist())) == expected
+
+
+def test_sample_responses_empty():
+    probabilities = csr_matrix((3, 3))
+    root_ind, users = sample_responses(probabilities, [], rng=np.random.default_rng(0))
+    assert len(root_ind) == 0 and len(users) == 0
+    root_ind, users = sample_responses(probabilities, [0, 1], rng=np.random.default_rng(0))
+    assert len(root_ind) == 0 and len(users) == 0
+
+
+def test_node_id_generator_unique_and_encodable():
+    generator = NodeIdGenerator(1234)
+    ids = np.concatenate([generator.generate(1000), generator.generate(1000)])
+    other_stream = NodeIdGenerator(1234, stream=1).generate(1000)
+    assert len(set(ids) | set(other_stream)) == 3000
+    assert all(len(node_id) == 22 and node_id.isalnum() for node_id in ids)
+
+    keys = NodeIdGenerator(1234).generate(1000, as_int=True)
+    assert keys.dtype == np.int64
+    assert NodeIdGenerator(1234).encode(keys).tolist() == ids[:1000].tolist()
@@ -0,0 +1,57 @@
+import threading
+
+from tools.ConfigHandler import TestConfigHandler as ConfigStub
+from tools.Graph import get_graph
+
+
+class _Data:
+    pass
+
+
+def _node(name, dependencies, calls, barrier=None):
+    def compute(self, dfs):
+        if barrier is not None:
+            # Only returns once both independent nodes are running
+            barrier.wait(timeout=10)
+        calls.append(name)
+        return [name] + [item for dependency in dependencies for item in get_graph(self.cfg, dfs).get(dependency)]
+
+    return type(name, (), {'dependencies': dependencies, '__init__': lambda self, cfg: setattr(self, 'cfg', cfg),
+                           'compute': compute})
+
+
+def test_nodes_run_once_and_independent_nodes_concurrently():
+    cfg = ConfigStub()
+    cfg.set('graph', {'n_workers': 2})
+    calls = []
+    barrier = threading.Barrier(2)
+    series = _node('Series', [], calls, barrier)
+    responses = _node('Responses', [], calls, barrier)
+    replay = _node('Replay', [series], calls)
+    probabilities = _node('Probabilities', [series, responses], calls)
+
+    dfs = _Data()
+    graph = get_graph(cfg, dfs)
+    graph.run([replay, probabilities])
+
+    assert sorted(calls) == ['Probabilities', 'Replay', 'Responses', 'Series']
+    assert graph.get(probabilities) == ['Probabilities', 'Series', 'Responses']
+    assert get_graph(cfg, dfs) is graph
+    assert set(graph.timings) == set(calls)
+    assert len(calls) == 4
+
+
+def test_graph_is_reset_when_data_is_appended():
+    cfg = ConfigStub()
+    cfg.set('graph', {'n_workers': 1})
+    calls = []
+    series = _node('Series', [], calls)
+
+    dfs = _Data()
+    dfs.appended = {}
+    graph = get_graph(cfg, dfs)
+    graph.get(series)
+    graph.get(series)
+    dfs.appended = {'Twitter': ['day2.csv']}
+    graph.get(series)
+    assert calls == ['Series', 'Series']
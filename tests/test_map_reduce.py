@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from tools.MapReduce import get_executor, reduce_list, SpillHandle
+
+
+def _map(indices, offset=0):
+    return [int(i) + offset for i in indices]
+
+
+@pytest.mark.parametrize('reduce_mode', ['tree', 'concat'])
+def test_serial_reduce_modes(reduce_mode):
+    partition = [np.arange(0, 3), np.arange(3, 5)]
+    executor = get_executor('serial', reduce_mode=reduce_mode)
+
+    assert executor.map_reduce(partition, _map, reduce_list, map_function_kwargs={'offset': 1}) == [1, 2, 3, 4, 5]
+
+
+def test_spill_returns_handles(tmp_path):
+    partition = [np.arange(0, 3), np.arange(3, 5)]
+    executor = get_executor('serial', reduce_mode='spill', spill_directory=str(tmp_path))
+    handles = executor.map_reduce(partition, _map, reduce_list, map_function_kwargs={'offset': 0})
+
+    assert all(isinstance(handle, SpillHandle) for handle in handles)
+    assert [handle.load() for handle in handles] == [[0, 1, 2], [3, 4]]
+
+
+def test_unknown_reduce_mode():
+    with pytest.raises(ValueError):
+        get_executor('serial', reduce_mode='merge')
+
+
+@pytest.mark.parametrize('n_partitions', [1, 2, 3, 5])
+def test_dask_tree_reduce_any_partition_count(n_partitions):
+    import dask
+    from tools.MapReduce import map_reduce
+
+    partition = [np.array([i]) for i in range(n_partitions)]
+    result = map_reduce(partition, dask.delayed(_map), dask.delayed(reduce_list), map_function_kwargs={},
+                        reduce_mode='tree')
+
+    assert sorted(result.compute(scheduler='sync')) == list(range(n_partitions))
+
+
+def test_partition_by_cost_balances_bins():
+    from tools.MapReduce import partition_by_cost
+
+    costs = np.array([10, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 6, 4])
+    bins = partition_by_cost(costs, 3, track_pos=True)
+
+    assert [pos for pos, __ in bins] == [0, 1, 2]
+    assert sorted(np.concatenate([b for __, b in bins])) == list(range(len(costs)))
+    assert [costs[b].sum() for __, b in bins] == [10, 10, 10]
+    assert all(np.all(np.diff(b) > 0) for __, b in bins)
+
+
+def test_heavy_users_are_split_over_time_bins():
+    import scipy.sparse as ss
+    from simulation.ParallelPoissonSimulation import _build_work_items
+
+    ts = ss.csr_matrix(np.array([[5, 0, 5, 5, 0, 5], [1, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 1, 0]]))
+    responses = {'reply': ss.csr_matrix(np.array([[0, 1, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [1, 0, 0, 0]]))}
+    items, costs = _build_work_items(ts, np.array([0, 1, 3]), responses, 4)
+
+    assert len(items[items[:, 0] == 0]) > 1
+    assert costs.sum() == 20 * 2 + 1 + 2 * 2
+    # Every nonzero entry of ts is covered by exactly one item
+    covered = ss.lil_matrix(ts.shape, dtype=int)
+    for user, first_bin, end_bin in items:
+        covered[user, first_bin:end_bin] = ts[user, first_bin:end_bin].toarray()
+    assert (covered.tocsr() != ts).nnz == 0
+    assert sum(ts[user, first_bin:end_bin].sum() for user, first_bin, end_bin in items) == ts.sum()